@@ -0,0 +1,237 @@
+import json
+import os
+import random
+import time
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from faker import Faker
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts import search, stats, timeline
+from posts.utils import CountingPaginator
+
+# Размер данных: BENCHMARK_SCALE=10 даёт тысячи пользователей и десятки
+# тысяч постов; по умолчанию — маленький набор для обычного прогона
+SCALE = int(os.environ.get('BENCHMARK_SCALE', 1))
+USERS = 100 * SCALE
+GROUPS = 5 * SCALE
+POSTS = 1000 * SCALE
+COMMENTS = 2000 * SCALE
+FOLLOWS_PER_USER = 20
+SAMPLES = int(os.environ.get('BENCHMARK_SAMPLES', 50))
+
+# Замер латентности и сравнение с baseline — только при BENCHMARK=1,
+# бюджеты запросов проверяются всегда. BENCHMARK_UPDATE=1 переписывает
+# baseline текущими результатами.
+BENCHMARK = os.environ.get('BENCHMARK') == '1'
+BENCHMARK_UPDATE = os.environ.get('BENCHMARK_UPDATE') == '1'
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# Допустимый рост p95 относительно baseline
+REGRESSION_THRESHOLD = float(os.environ.get('BENCHMARK_THRESHOLD', 1.0))
+
+# Максимум SQL-запросов на запрос к странице (с холодным кэшем)
+QUERY_BUDGETS = {
+    'posts:index': 3,
+    'posts:group_list': 4,
+    'posts:profile': 6,
+    'posts:post_detail': 6,
+    'posts:follow_index': 4,
+    'posts:post_create': 9,
+    # Вставка комментария и UPDATE счётчика comment_count поста
+    'posts:create_comment': 5,
+    'posts:profile_follow': 12,
+    'posts:profile_unfollow': 7,
+}
+
+# Предел размера HTML блока Paginator для ленты в 200 тысяч страниц
+PAGINATOR_PAGES = 200000
+PAGINATOR_HTML_BUDGET = 4096
+
+RESULTS = {}
+
+
+def percentile(samples, percent):
+    """ Перцентиль по отсортированным замерам, без интерполяции """
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100 * len(ordered))))
+    return ordered[index]
+
+
+@pytest.fixture(scope='module')
+def dataset(django_db_setup, django_db_blocker):
+    """ Реалистичный набор данных, общий для всех замеров модуля """
+    fake = Faker('ru_RU')
+    Faker.seed(0)
+    rnd = random.Random(0)
+    with django_db_blocker.unblock():
+        User.objects.bulk_create(
+            User(username='bench_{}'.format(index))
+            for index in range(USERS))
+        users = list(User.objects.filter(
+            username__startswith='bench_').values_list('pk', flat=True))
+        Group.objects.bulk_create(
+            Group(title=fake.sentence(nb_words=3)[:200],
+                  slug='bench-{}'.format(index),
+                  description=fake.text())
+            for index in range(GROUPS))
+        groups = list(Group.objects.filter(
+            slug__startswith='bench-').values_list('pk', flat=True))
+        Post.objects.bulk_create(
+            (Post(text=fake.text(max_nb_chars=1000),
+                  author_id=rnd.choice(users),
+                  group_id=rnd.choice(groups + [None]))
+             for _ in range(POSTS)), batch_size=500)
+        posts = list(Post.objects.filter(
+            author_id__in=users).values_list('pk', flat=True))
+        Comment.objects.bulk_create(
+            (Comment(text=fake.sentence(),
+                     author_id=rnd.choice(users),
+                     post_id=rnd.choice(posts))
+             for _ in range(COMMENTS)), batch_size=500)
+        follows = {
+            (user, author) for user in users
+            for author in rnd.sample(users, FOLLOWS_PER_USER)
+            if user != author
+        }
+        # Подписку первого пользователя на второго проверяет бенчмарк
+        follows.discard((users[0], users[1]))
+        Follow.objects.bulk_create(
+            (Follow(user_id=user, author_id=author)
+             for user, author in follows), batch_size=500)
+        # bulk_create обходит сигналы: ленты, счётчики и индекс вручную
+        timeline.fan_out(Post.objects.filter(author_id__in=users))
+        stats.recount_all()
+        stats.recount_comments()
+        search.rebuild()
+        yield {
+            'user': User.objects.get(pk=users[0]),
+            'author': User.objects.get(pk=users[1]),
+            'group': Group.objects.get(pk=groups[0]),
+            'post': Post.objects.get(pk=posts[0]),
+        }
+        User.objects.filter(pk__in=users).delete()
+        Group.objects.filter(pk__in=groups).delete()
+        search.rebuild()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def write_baseline():
+    yield
+    if BENCHMARK_UPDATE and RESULTS:
+        with open(BASELINE_PATH, 'w') as baseline:
+            json.dump(RESULTS, baseline, indent=2, sort_keys=True)
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_PATH) as baseline:
+            return json.load(baseline)
+    except (OSError, ValueError):
+        return {}
+
+
+class TestViewsBenchmark:
+
+    def measure(self, client, name, request, setup=None):
+        """ Число запросов с холодным кэшем и латентность p50/p95 """
+        if setup:
+            setup()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        assert response.status_code in (200, 302), (
+            f'Страница `{name}` ответила {response.status_code}'
+        )
+        result = {'queries': len(queries)}
+        if BENCHMARK or BENCHMARK_UPDATE:
+            samples = []
+            for _ in range(SAMPLES):
+                if setup:
+                    setup()
+                started = time.perf_counter()
+                request()
+                samples.append((time.perf_counter() - started) * 1000)
+            result['p50_ms'] = round(percentile(samples, 50), 3)
+            result['p95_ms'] = round(percentile(samples, 95), 3)
+        RESULTS[name] = result
+        return result
+
+    def check(self, name, result):
+        assert result['queries'] <= QUERY_BUDGETS[name], (
+            f'Страница `{name}` выполняет {result["queries"]} SQL-запросов, '
+            f'бюджет — {QUERY_BUDGETS[name]}. Проверьте N+1 в шаблонах'
+        )
+        baseline = load_baseline().get(name)
+        if BENCHMARK and baseline and 'p95_ms' in result:
+            limit = baseline['p95_ms'] * (1 + REGRESSION_THRESHOLD)
+            assert result['p95_ms'] <= limit, (
+                f'p95 страницы `{name}` вырос до {result["p95_ms"]} мс '
+                f'(baseline {baseline["p95_ms"]} мс)'
+            )
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('name', [
+        'posts:index', 'posts:group_list', 'posts:profile',
+        'posts:post_detail', 'posts:follow_index',
+    ])
+    def test_read_views(self, client, dataset, name):
+        args = {
+            'posts:group_list': (dataset['group'].slug,),
+            'posts:profile': (dataset['author'].username,),
+            'posts:post_detail': (dataset['post'].pk,),
+        }.get(name)
+        client.force_login(dataset['user'])
+        url = reverse(name, args=args)
+        self.check(name, self.measure(client, name, lambda: client.get(url)))
+
+    @pytest.mark.django_db
+    def test_write_views(self, client, dataset):
+        client.force_login(dataset['user'])
+        author = dataset['author']
+        following = Follow.objects.filter(user=dataset['user'], author=author)
+
+        def follow():
+            Follow.objects.get_or_create(user=dataset['user'], author=author)
+
+        writes = (
+            ('posts:post_create', None, {'text': 'Бенчмарк'}, None),
+            ('posts:create_comment', (dataset['post'].pk,),
+             {'text': 'Бенчмарк'}, None),
+            ('posts:profile_follow', (author.username,), None,
+             following.delete),
+            ('posts:profile_unfollow', (author.username,), None, follow),
+        )
+        for name, args, data, setup in writes:
+            url = reverse(name, args=args)
+            if data is None:
+                def request():
+                    return client.get(url)
+            else:
+                def request():
+                    return client.post(url, data)
+            self.check(name, self.measure(client, name, request, setup))
+
+
+@pytest.mark.parametrize('number', [1, PAGINATOR_PAGES // 2, PAGINATOR_PAGES])
+def test_paginator_render_size(number):
+    """ Размер блока Paginator не зависит от числа страниц """
+    # range знает свою длину без перебора, как COUNT из кэша
+    paginator = CountingPaginator(range(PAGINATOR_PAGES), 1)
+    started = time.perf_counter()
+    html = render_to_string(
+        'posts/includes/paginator.html',
+        {'page_obj': paginator.get_page(number)})
+    elapsed = (time.perf_counter() - started) * 1000
+    size = len(html.encode())
+    RESULTS['paginator_html:{}'.format(number)] = {
+        'bytes': size, 'render_ms': round(elapsed, 3)}
+    assert size <= PAGINATOR_HTML_BUDGET, (
+        f'Блок Paginator для {PAGINATOR_PAGES} страниц занимает '
+        f'{size} байт, бюджет — {PAGINATOR_HTML_BUDGET}'
+    )
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     """ Приложения для контекст-процессоров и CSS фильтров"""
     name = 'core'
+
+    def ready(self):
+        from . import fragments  # noqa: F401
@@ -0,0 +1,452 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL,
+        size INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    # Итоги по таблице ведут триггеры: проверка лимитов без count(*)
+    """
+    CREATE TABLE IF NOT EXISTS cache_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        entries INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )
+    """,
+    'INSERT OR IGNORE INTO cache_totals VALUES (1, 0, 0)',
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+        UPDATE cache_totals
+        SET entries = entries + 1, bytes = bytes + new.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+        UPDATE cache_totals
+        SET entries = entries - 1, bytes = bytes - old.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache
+    BEGIN
+        UPDATE cache_totals SET bytes = bytes - old.size + new.size;
+    END
+    """,
+)
+UPSERT = """
+INSERT INTO cache (key, value, expires, accessed, size)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value, expires = excluded.expires,
+    accessed = excluded.accessed, size = excluded.size
+"""
+# Время последнего обращения обновляется не чаще раза в секунду:
+# иначе каждое чтение превращалось бы в запись
+ACCESS_RESOLUTION = 1
+# SQLite ограничивает число параметров запроса
+MAX_PARAMS = 900
+
+
+class SQLiteCache(BaseCache):
+    """ Кэш в SQLite-файле (WAL), общий для всех процессов сервера.
+
+    LOCATION — путь к файлу. Помимо MAX_ENTRIES и CULL_FREQUENCY
+    понимает OPTIONS['MAX_SIZE'] — предел суммарного размера значений
+    в байтах. При превышении любого предела вытесняются давно
+    не читавшиеся записи.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = location
+        options = params.get('OPTIONS') or {}
+        self.max_size = int(options.get('MAX_SIZE', 0)) or None
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # После fork соединение родителя использовать нельзя
+        if self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.location, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _write(self):
+        """ Транзакция, сразу берущая блокировку записи """
+        return _Transaction(self.connection)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _row(self, key, value, timeout, now):
+        data = pickle.dumps(value, self.pickle_protocol)
+        return key, data, self.get_backend_timeout(timeout), now, len(data)
+
+    def _fetch(self, keys):
+        """ Живые значения по ключам, с отметкой о чтении для LRU """
+        now = time.time()
+        found = {}
+        stale = []
+        for start in range(0, len(keys), MAX_PARAMS):
+            chunk = keys[start:start + MAX_PARAMS]
+            rows = self.connection.execute(
+                'SELECT key, value, expires, accessed FROM cache '
+                'WHERE key IN ({})'.format(', '.join('?' * len(chunk))),
+                chunk)
+            for key, data, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[key] = pickle.loads(data)
+                if accessed < now - ACCESS_RESOLUTION:
+                    stale.append((now, key))
+        if stale:
+            self.connection.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', stale)
+        return found
+
+    def _cull(self, now):
+        """ Удалить просроченное и, если нужно, давно не читавшееся """
+        entries, size = self.connection.execute(
+            'SELECT entries, bytes FROM cache_totals').fetchone()
+        over_entries = entries > self._max_entries
+        over_size = self.max_size is not None and size > self.max_size
+        if not (over_entries or over_size):
+            return
+        self.connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (now,))
+        entries, size = self.connection.execute(
+            'SELECT entries, bytes FROM cache_totals').fetchone()
+        if entries > self._max_entries:
+            count = max(entries - self._max_entries,
+                        entries // self._cull_frequency)
+            self._evict(count)
+        if self.max_size is not None and size > self.max_size:
+            # Освобождаем место с тем же запасом, что и по числу записей
+            target = self.max_size - self.max_size // self._cull_frequency
+            rows = self.connection.execute(
+                'SELECT key, size FROM cache ORDER BY accessed')
+            evict = []
+            for key, row_size in rows:
+                if size <= target:
+                    break
+                evict.append((key,))
+                size -= row_size
+            self.connection.executemany(
+                'DELETE FROM cache WHERE key = ?', evict)
+
+    def _evict(self, count):
+        self.connection.execute(
+            'DELETE FROM cache WHERE key IN '
+            '(SELECT key FROM cache ORDER BY accessed LIMIT ?)', (count,))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._fetch([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = self._fetch(list(keys))
+        return {keys[key]: value for key, value in found.items()}
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self.connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)', (key, time.time()))
+        return row.fetchone() is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        rows = [self._row(self._key(key, version), value, timeout, now)
+                for key, value in data.items()]
+        with self._write():
+            self.connection.executemany(UPSERT, rows)
+            self._cull(now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._write():
+            # Просроченная запись не мешает add
+            self.connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, now))
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO cache '
+                '(key, value, expires, accessed, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                self._row(key, value, timeout, now))
+            added = cursor.rowcount == 1
+            if added:
+                self._cull(now)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        cursor = self.connection.execute(
+            'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), now, key, now))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        """ Атомарное увеличение: чтение и запись в одной транзакции """
+        key = self._key(key, version)
+        now = time.time()
+        with self._write():
+            row = self.connection.execute(
+                'SELECT value, expires FROM cache WHERE key = ?',
+                (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, self.pickle_protocol)
+            self.connection.execute(
+                'UPDATE cache SET value = ?, accessed = ?, size = ? '
+                'WHERE key = ?', (data, now, len(data), key))
+        return value
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._key(key, version),) for key in keys]
+        with self._write():
+            self.connection.executemany(
+                'DELETE FROM cache WHERE key = ?', keys)
+
+    def clear(self):
+        with self._write():
+            self.connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединение живёт всё время процесса: открывать файл
+        # на каждый запрос дороже, чем держать его
+        pass
+
+
+# Значения этих типов отдаются из памяти как есть, остальные — копией
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+_missing = object()
+# Верхний уровень общий для всех потоков процесса
+_local_stores = {}
+_local_stats = {}
+_local_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """ Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+
+    LOCATION — алиас нижнего кэша из settings.CACHES. В памяти запись
+    живёт не дольше OPTIONS['LOCAL_TIMEOUT'] секунд, их не больше
+    OPTIONS['LOCAL_MAX_ENTRIES']. Ключи с префиксами из
+    OPTIONS['LOCAL_BYPASS'] (счётчики версий) всегда читаются снизу:
+    их увеличение в другом процессе сразу сбрасывает зависящие
+    от версии фрагменты.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS') or {}
+        self.lower_alias = location
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.local_max_entries = options.get('LOCAL_MAX_ENTRIES', 1000)
+        self.bypass = tuple(options.get('LOCAL_BYPASS', ()))
+        with _local_lock:
+            self._store = _local_stores.setdefault(location, OrderedDict())
+            self._stats = _local_stats.setdefault(location, dict.fromkeys(
+                ('local_hits', 'local_misses', 'lower_hits', 'lower_misses'),
+                0))
+
+    @property
+    def lower(self):
+        return caches[self.lower_alias]
+
+    def _local_key(self, key, version):
+        if isinstance(key, str) and key.startswith(self.bypass):
+            return None
+        return self.make_key(key, version=version)
+
+    def _count(self, name, count=1):
+        with _local_lock:
+            self._stats[name] += count
+
+    def _local_get(self, local_key):
+        with _local_lock:
+            entry = self._store.get(local_key)
+            if entry is None:
+                return _missing
+            expires, pickled, value = entry
+            if expires <= time.monotonic():
+                del self._store[local_key]
+                return _missing
+            self._store.move_to_end(local_key)
+        return pickle.loads(value) if pickled else value
+
+    def _local_set(self, local_key, value):
+        if local_key is None:
+            return
+        pickled = not isinstance(value, IMMUTABLE_TYPES)
+        if pickled:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = time.monotonic() + self.local_timeout
+        with _local_lock:
+            self._store[local_key] = (expires, pickled, value)
+            self._store.move_to_end(local_key)
+            while len(self._store) > self.local_max_entries:
+                self._store.popitem(last=False)
+
+    def _local_delete(self, local_keys):
+        with _local_lock:
+            for local_key in local_keys:
+                self._store.pop(local_key, None)
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            value = self._local_get(local_key)
+            if value is not _missing:
+                self._count('local_hits')
+                return value
+            self._count('local_misses')
+        value = self.lower.get(key, _missing, version)
+        if value is _missing:
+            self._count('lower_misses')
+            return default
+        self._count('lower_hits')
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        rest = []
+        for key in keys:
+            local_key = self._local_key(key, version)
+            value = _missing
+            if local_key is not None:
+                value = self._local_get(local_key)
+            if value is _missing:
+                rest.append(key)
+            else:
+                found[key] = value
+        self._count('local_hits', len(found))
+        self._count('local_misses', len(rest))
+        if rest:
+            lower = self.lower.get_many(rest, version)
+            self._count('lower_hits', len(lower))
+            self._count('lower_misses', len(rest) - len(lower))
+            for key, value in lower.items():
+                self._local_set(self._local_key(key, version), value)
+            found.update(lower)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.lower.has_key(key, version)
+
+    def _remember(self, key, value, timeout, version):
+        local_key = self._local_key(key, version)
+        if timeout is not None and timeout <= 0:
+            self._local_delete([local_key])
+        else:
+            self._local_set(local_key, value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        self.lower.set(key, value, timeout, version)
+        self._remember(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        failed = self.lower.set_many(data, timeout, version)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        added = self.lower.add(key, value, timeout, version)
+        if added:
+            self._remember(key, value, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.lower.touch(key, self._timeout(timeout), version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete([self._local_key(key, version)])
+        return self.lower.incr(key, delta, version)
+
+    def delete(self, key, version=None):
+        self._local_delete([self._local_key(key, version)])
+        self.lower.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        self._local_delete([self._local_key(key, version) for key in keys])
+        self.lower.delete_many(keys, version)
+
+    def clear(self):
+        with _local_lock:
+            self._store.clear()
+        self.lower.clear()
+
+    def stats(self):
+        """ Попадания и промахи по уровням в этом процессе """
+        with _local_lock:
+            stats = dict(self._stats)
+        for tier in ('local', 'lower'):
+            lookups = stats[tier + '_hits'] + stats[tier + '_misses']
+            stats[tier + '_hit_rate'] = (
+                stats[tier + '_hits'] / lookups if lookups else None)
+        return stats
+
+    def reset_stats(self):
+        with _local_lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+class _Transaction:
+    """ BEGIN IMMEDIATE ... COMMIT/ROLLBACK """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
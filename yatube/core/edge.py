@@ -0,0 +1,114 @@
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+
+from .page_cache import apply_validators, is_current
+
+EDGE_KEY = 'edge:{}'
+MARKER = '<!--edge:{}-->'
+MARKER_RE = re.compile(r'<!--edge:(.*?)-->', re.DOTALL)
+# Экранирование, после которого JSON не закроет HTML-комментарий
+JSON_ESCAPES = {ord('<'): '\\u003C', ord('>'): '\\u003E', ord('&'): '\\u0026'}
+# Заголовки, посчитанные для конкретного пользователя
+PERSONAL_HEADERS = {'ETag', 'Last-Modified', 'Cache-Control'}
+
+_fragments = {}
+
+
+def fragment(name, template_name):
+    """ Зарегистрировать персональный фрагмент страницы.
+
+    Функция получает request и аргументы из {% edge %} и возвращает
+    контекст шаблона фрагмента.
+    """
+    def decorator(func):
+        _fragments[name] = (template_name, func)
+        return func
+    return decorator
+
+
+def render_fragment(request, name, kwargs):
+    template_name, func = _fragments[name]
+    return render_to_string(
+        template_name, func(request, **kwargs), request=request)
+
+
+def marker(name, kwargs):
+    """ Метка на месте фрагмента в общей части страницы """
+    return MARKER.format(json.dumps(
+        [name, kwargs], sort_keys=True).translate(JSON_ESCAPES))
+
+
+def stitch(request, content):
+    """ Подставить в общую часть фрагменты текущего пользователя """
+    def replace(match):
+        name, kwargs = json.loads(match.group(1))
+        return render_fragment(request, name, kwargs)
+    return MARKER_RE.sub(replace, content)
+
+
+class EdgeIncludeMiddleware:
+    """ Общая для всех часть страницы плюс персональные фрагменты.
+
+    Для авторизованных пользователей view рендерит страницу с метками
+    вместо фрагментов {% edge %}. Такая страница одна на всех и
+    кэшируется по пути, как страницы анонимов; перед ответом метки
+    заменяются фрагментами текущего пользователя. Ставится после
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PAGE_CACHE_TIMEOUT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method != 'GET' or not request.user.is_authenticated:
+            return self.get_response(request)
+        key = EDGE_KEY.format(hashlib.md5(
+            request.get_full_path().encode()).hexdigest())
+        entry = cache.get(key)
+        if entry is not None and is_current(entry['versions']):
+            request.page_cache_view = entry['view_name']
+            return self.from_cache(request, entry)
+        request.edge_shared = True
+        request.page_cache_tags = {}
+        response = self.get_response(request)
+        if response.streaming or 'html' not in response.get(
+                'Content-Type', ''):
+            return response
+        shared = response.content.decode(response.charset)
+        if (request.page_cache_tags and response.status_code == 200
+                and not response.cookies):
+            cache.set(key, {
+                'content': shared,
+                'headers': [(header, value)
+                            for header, value in response.items()
+                            if header not in PERSONAL_HEADERS],
+                'versions': request.page_cache_tags,
+                'modified': request.page_cache_modified,
+                'view_name': request.resolver_match.view_name,
+            }, settings.PAGE_CACHE_TIMEOUT)
+        response.content = stitch(request, shared)
+        return response
+
+    def from_cache(self, request, entry):
+        response = HttpResponse()
+        for header, value in entry['headers']:
+            response[header] = value
+        apply_validators(request, response, entry['versions'],
+                         entry['modified'])
+        not_modified = get_conditional_response(
+            request, etag=response['ETag'],
+            last_modified=int(entry['modified']), response=response)
+        if not_modified is response:
+            response.content = stitch(request, entry['content'])
+        not_modified['X-Page-Cache'] = 'edge'
+        return not_modified
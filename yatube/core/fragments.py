@@ -0,0 +1,7 @@
+from .edge import fragment
+
+
+@fragment('header_user', 'includes/header_user.html')
+def header_user(request, view_name=None):
+    """ Ссылки шапки, зависящие от пользователя """
+    return {'view_name': view_name}
@@ -0,0 +1,169 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .profiling import BUCKETS_MS, Histograms
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    view TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (view, name)
+) WITHOUT ROWID
+"""
+UPSERT = """
+INSERT INTO metrics (view, name, value) VALUES (?, ?, ?)
+ON CONFLICT (view, name) DO UPDATE SET value = value + excluded.value
+"""
+BUCKET_NAMES = tuple('bucket_{}'.format(bound) for bound in BUCKETS_MS)
+BUCKET_NAMES += ('bucket_inf',)
+COUNTERS = ('count', 'sum_ms', 'queries', 'cache_hits', 'cache_misses')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsStore:
+    """ Метрики запросов, общие для всех процессов-воркеров.
+
+    Каждый процесс копит замеры в памяти и раз в METRICS_FLUSH_INTERVAL
+    секунд добавляет накопленное в SQLite-файл METRICS_DB одной
+    транзакцией; значения в файле только растут.
+    """
+
+    def __init__(self):
+        self.pending = Histograms()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_key = None
+        self._flushed = time.monotonic()
+        atexit.register(self.flush)
+
+    def connect(self):
+        """ Соединение с файлом метрик; после fork открывается заново """
+        key = (os.getpid(), settings.METRICS_DB)
+        if self._connection_key != key:
+            connection = sqlite3.connect(
+                settings.METRICS_DB, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute(SCHEMA)
+            self._connection = connection
+            self._connection_key = key
+        return self._connection
+
+    def record(self, name, profile):
+        self.pending.observe(name, profile)
+        interval = settings.METRICS_FLUSH_INTERVAL
+        if time.monotonic() - self._flushed >= interval:
+            self.flush()
+
+    def flush(self):
+        """ Добавить накопленное процессом в общий файл.
+
+        flush() вызывается из запроса пользователя, поэтому ошибка
+        SQLite (например, "database is locked") не выходит наружу:
+        замеры возвращаются в память до следующей попытки.
+        """
+        with self._lock:
+            self._flushed = time.monotonic()
+            data = self.pending.drain()
+            if not data:
+                return
+            rows = []
+            for view, entry in data.items():
+                rows.extend((view, name, entry[name]) for name in COUNTERS)
+                rows.extend(
+                    (view, name, count)
+                    for name, count in zip(BUCKET_NAMES, entry['buckets'])
+                    if count)
+            try:
+                self._write(rows)
+            except Exception:
+                logger.exception('Metrics flush failed, will retry')
+                self.pending.merge(data)
+
+    def _write(self, rows):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(UPSERT, rows)
+            connection.execute('COMMIT')
+        except Exception:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def collect(self):
+        """ Метрики всех процессов: {view: {name: value}} """
+        self.flush()
+        with self._lock:
+            rows = self.connect().execute(
+                'SELECT view, name, value FROM metrics ORDER BY view')
+            result = {}
+            for view, name, value in rows:
+                result.setdefault(view, {})[name] = value
+        return result
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _number(value):
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_prometheus(metrics):
+    """ Метрики в текстовом формате Prometheus """
+    lines = [
+        '# HELP yatube_request_duration_seconds Время ответа по view.',
+        '# TYPE yatube_request_duration_seconds histogram',
+    ]
+    for view, values in metrics.items():
+        label = _label(view)
+        cumulative = 0
+        for bound, name in zip(BUCKETS_MS + ('+Inf',), BUCKET_NAMES):
+            cumulative += values.get(name, 0)
+            le = bound if bound == '+Inf' else _number(bound / 1000)
+            lines.append(
+                'yatube_request_duration_seconds_bucket'
+                '{{view="{}",le="{}"}} {}'.format(
+                    label, le, _number(cumulative)))
+        lines.append('yatube_request_duration_seconds_sum{{view="{}"}} {}'
+                     .format(label, _number(values.get('sum_ms', 0) / 1000)))
+        lines.append('yatube_request_duration_seconds_count{{view="{}"}} {}'
+                     .format(label, _number(values.get('count', 0))))
+    counters = (
+        ('yatube_requests_total', 'count', 'Число запросов по view.'),
+        ('yatube_db_queries_total', 'queries', 'Число SQL-запросов по view.'),
+        ('yatube_cache_hits_total', 'cache_hits', 'Попадания в кэш по view.'),
+        ('yatube_cache_misses_total', 'cache_misses',
+         'Промахи кэша по view.'),
+    )
+    for metric, name, help_text in counters:
+        lines.append('# HELP {} {}'.format(metric, help_text))
+        lines.append('# TYPE {} counter'.format(metric))
+        for view, values in metrics.items():
+            lines.append('{}{{view="{}"}} {}'.format(
+                metric, _label(view), _number(values.get(name, 0))))
+    lines.append('# HELP yatube_cache_hit_ratio Доля попаданий в кэш по view.')
+    lines.append('# TYPE yatube_cache_hit_ratio gauge')
+    for view, values in metrics.items():
+        lookups = values.get('cache_hits', 0) + values.get('cache_misses', 0)
+        if lookups:
+            lines.append('yatube_cache_hit_ratio{{view="{}"}} {}'.format(
+                _label(view), _number(values['cache_hits'] / lookups)))
+    return '\n'.join(lines) + '\n'
+
+
+store = MetricsStore()
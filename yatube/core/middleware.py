@@ -0,0 +1,94 @@
+import json
+import logging
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics, profiling
+
+logger = logging.getLogger('core.profiling')
+
+
+@contextmanager
+def measure():
+    """ Замер запроса: SQL-запросы всех соединений, кэш и общее время.
+
+    Внутри уже идущего замера новый не начинается: middleware метрик
+    и профилирования делят один замер, и запросы не считаются дважды.
+    """
+    profile = profiling.current()
+    if profile is not None:
+        try:
+            yield profile
+        finally:
+            profile.stop()
+        return
+    token = profiling.start()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(profiling.query_wrapper))
+            yield profiling.current()
+    finally:
+        profiling.finish(token)
+
+
+def view_name(request):
+    """ Имя URL запроса; для ответа из кэша страниц — имя, под которым
+    его записала PageCacheMiddleware """
+    match = request.resolver_match
+    return match.view_name if match else getattr(
+        request, 'page_cache_view', 'unresolved')
+
+
+class MetricsMiddleware:
+    """ Метрики запросов для /metrics: число, время, SQL и кэш по view.
+
+    Включается настройкой METRICS_ENABLED (по умолчанию включена) и
+    не зависит от профилирования: замер шаблонов, Server-Timing и лог
+    остаются за ProfilingMiddleware.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        profiling.install_cache()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with measure() as profile:
+            response = self.get_response(request)
+        metrics.store.record(view_name(request), profile)
+        return response
+
+
+class ProfilingMiddleware:
+    """ Профилирование запросов: SQL, шаблоны, кэш и общее время.
+
+    Включается настройкой PROFILING_ENABLED; выключенная middleware
+    исключается из цепочки при загрузке обработчика.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        profiling.install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with measure() as profile:
+            response = self.get_response(request)
+        name = view_name(request)
+        profiling.histograms.observe(name, profile)
+        response['Server-Timing'] = profile.server_timing()
+        logger.info(json.dumps(dict(
+            profile.as_dict(),
+            view=name,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+        ), ensure_ascii=False))
+        return response
@@ -0,0 +1,207 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils.cache import (
+    cc_delim_re, get_conditional_response, patch_cache_control,
+    patch_vary_headers)
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+PAGE_KEY = 'page:{}'
+TAG_KEY = 'page:tag:{}'
+MODIFIED_KEY = 'page:tag:modified:{}'
+# Тег, которым неявно помечена каждая страница: его сброс делает
+# устаревшим весь кэш страниц (например, после смены рендера)
+ALL_TAG = 'all'
+# Vary, при котором страница для анонимов без этих cookie одинакова
+SAFE_VARY = {'cookie', 'accept-encoding'}
+
+
+def tag(request, *tags):
+    """ Отметить, от каких объектов зависит страница.
+
+    Кэшируются только страницы, у которых есть теги. Версии тегов
+    запоминаются до того, как view прочитает данные: изменение,
+    случившееся во время рендера, не спрячется за новой версией.
+    """
+    return remember(request, *tag_state(tags))[0]
+
+
+def remember(request, versions, modified):
+    page_versions = getattr(request, 'page_cache_tags', None)
+    if page_versions is not None:
+        page_versions.update(versions)
+        request.page_cache_modified = max(
+            modified, getattr(request, 'page_cache_modified', 0))
+    return versions, modified
+
+
+def invalidate(*tags):
+    """ Сделать устаревшими все страницы с этими тегами """
+    for name in tags:
+        try:
+            cache.incr(TAG_KEY.format(name))
+        except ValueError:
+            # Версии нет — значит и сохранённые с ней страницы устарели
+            pass
+    cache.set_many(
+        {MODIFIED_KEY.format(name): time.time() for name in tags}, None)
+
+
+def tag_state(tags):
+    """ Текущие версии тегов и время последнего изменения любого из них.
+
+    Отсутствующие версии заводятся заново.
+    """
+    tags = (*tags, ALL_TAG)
+    keys = {TAG_KEY.format(name): name for name in tags}
+    modified_keys = [MODIFIED_KEY.format(name) for name in tags]
+    found = cache.get_many(list(keys) + modified_keys)
+    now = time.time()
+    versions = {}
+    for key, name in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = int(now * 1000)
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[name] = version
+    missing = [key for key in modified_keys if key not in found]
+    if missing:
+        # Время изменения неизвестно: считаем, что это было сейчас
+        cache.set_many(dict.fromkeys(missing, now), None)
+    return versions, max(found.get(key, now) for key in modified_keys)
+
+
+def is_current(versions):
+    keys = {TAG_KEY.format(name): version
+            for name, version in versions.items()}
+    found = cache.get_many(list(keys))
+    return all(found.get(key) == version for key, version in keys.items())
+
+
+def etag_for(request, versions):
+    """ ETag страницы: версии тегов и то, что отличает пользователя """
+    parts = [repr(sorted(versions.items()))]
+    if request.user.is_authenticated:
+        # Токен CSRF попадает в формы страницы
+        parts += [str(request.user.pk),
+                  request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')]
+    return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+def apply_validators(request, response, versions, modified, max_age=0):
+    """ ETag, Last-Modified и Cache-Control страницы с этими тегами """
+    response['ETag'] = etag_for(request, versions)
+    response['Last-Modified'] = http_date(int(modified))
+    if request.user.is_authenticated:
+        patch_cache_control(
+            response, private=True, max_age=0, must_revalidate=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    patch_vary_headers(response, ('Cookie',))
+
+
+def conditional_page(tags, max_age=0):
+    """ Условный GET (ETag / Last-Modified) по тегам страницы.
+
+    tags(request, *args, **kwargs) возвращает теги страницы; по их
+    версиям без обращения к базе отвечаем 304 Not Modified. Заодно
+    страница помечается тегами для кэша страниц.
+    max_age — сколько секунд публичный ответ можно не перепроверять.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or 'messages' in request.COOKIES):
+                return view(request, *args, **kwargs)
+            versions, modified = remember(
+                request, *tag_state(tags(request, *args, **kwargs)))
+            response = get_conditional_response(
+                request, etag=etag_for(request, versions),
+                last_modified=int(modified))
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                apply_validators(
+                    request, response, versions, modified, max_age)
+            return response
+        return wrapper
+    return decorator
+
+
+class PageCacheMiddleware:
+    """ Кэш целых страниц для анонимных посетителей.
+
+    Ключ — путь с query string. Запросы с cookie сессии или сообщений
+    и всё, кроме GET, идут мимо кэша. Страница устаревает, когда
+    меняется версия любого из её тегов (см. tag и invalidate), или
+    через PAGE_CACHE_TIMEOUT секунд.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PAGE_CACHE_TIMEOUT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.bypass_cookies = (settings.SESSION_COOKIE_NAME, 'messages')
+
+    def __call__(self, request):
+        if request.method != 'GET' or any(
+                name in request.COOKIES for name in self.bypass_cookies):
+            return self.get_response(request)
+        key = PAGE_KEY.format(hashlib.md5(
+            request.get_full_path().encode()).hexdigest())
+        entry = cache.get(key)
+        if entry is not None and is_current(entry[3]):
+            status, headers, content, versions, view_name = entry
+            # Для профилирования: resolve() при попадании не выполняется
+            request.page_cache_view = view_name
+            response = HttpResponse(content, status=status)
+            for header, value in headers:
+                response[header] = value
+            response['X-Page-Cache'] = 'hit'
+            return self.conditional(request, response)
+        request.page_cache_tags = {}
+        response = self.get_response(request)
+        versions = request.page_cache_tags
+        if versions and self.cacheable(response):
+            cache.set(key, (
+                response.status_code,
+                list(response.items()),
+                response.content,
+                versions,
+                request.resolver_match.view_name,
+            ), settings.PAGE_CACHE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    def cacheable(self, response):
+        if (response.status_code != 200 or response.streaming
+                or response.cookies):
+            return False
+        if response.has_header('Vary'):
+            vary = {header.lower() for header in
+                    cc_delim_re.split(response['Vary'])}
+            if not vary <= SAFE_VARY:
+                return False
+        cache_control = response.get('Cache-Control', '').lower()
+        return 'private' not in cache_control and (
+            'no-store' not in cache_control)
+
+    def conditional(self, request, response):
+        """ 304, если у клиента та же версия страницы """
+        last_modified = response.get('Last-Modified')
+        not_modified = get_conditional_response(
+            request,
+            etag=response.get('ETag'),
+            last_modified=last_modified and parse_http_date_safe(
+                last_modified),
+            response=response)
+        if not_modified is not response:
+            not_modified['X-Page-Cache'] = 'hit'
+        return not_modified
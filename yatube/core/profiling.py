@@ -0,0 +1,206 @@
+import contextvars
+import threading
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.template.base import Template
+
+# Границы корзин гистограммы латентности, в миллисекундах
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = contextvars.ContextVar('request_profile', default=None)
+_missing = object()
+_install_lock = threading.Lock()
+_installed = False
+
+
+class RequestProfile:
+    """ Замеры одного запроса """
+    __slots__ = ('started', 'total', 'queries', 'db_time', 'template_time',
+                 'template_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def stop(self):
+        """ Время от начала замера до этого момента """
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """ Значение заголовка Server-Timing """
+        return ', '.join((
+            'db;dur={:.1f};desc="{} queries"'.format(
+                self.db_time * 1000, self.queries),
+            'tpl;dur={:.1f}'.format(self.template_time * 1000),
+            'cache;desc="hits={} misses={}"'.format(
+                self.cache_hits, self.cache_misses),
+            'total;dur={:.1f}'.format(self.total * 1000),
+        ))
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total * 1000, 3),
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 3),
+            'template_ms': round(self.template_time * 1000, 3),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def start():
+    """ Начать замер запроса; возвращает токен для finish() """
+    return _current.set(RequestProfile())
+
+
+def current():
+    """ Замер текущего запроса или None """
+    return _current.get()
+
+
+def finish(token):
+    """ Закончить замер и вернуть его результаты """
+    profile = _current.get()
+    profile.stop()
+    _current.reset(token)
+    return profile
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """ execute_wrapper для подсчёта SQL-запросов и их времени """
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - started
+
+
+def _profiled_render(render):
+    def wrapper(self, context):
+        profile = _current.get()
+        # Вложенные шаблоны (include, extends) уже внутри замера внешнего
+        if profile is None or profile.template_depth:
+            return render(self, context)
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            profile.template_time += time.perf_counter() - started
+    return wrapper
+
+
+def _profiled_get(get):
+    def wrapper(self, key, default=None, version=None):
+        value = get(self, key, _missing, version)
+        profile = _current.get()
+        if profile is not None:
+            if value is _missing:
+                profile.cache_misses += 1
+            else:
+                profile.cache_hits += 1
+        return default if value is _missing else value
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_cache():
+    """ Подключить подсчёт попаданий в кэш; повторный вызов ничего не меняет
+
+    Считаем обращения к кэшу, которым пользуется код; нижний уровень
+    двухуровневого кэша дал бы повторный счёт.
+    """
+    with _install_lock:
+        backend = type(caches[DEFAULT_CACHE_ALIAS])
+        if not getattr(backend.get, 'profiled', False):
+            backend.get = _profiled_get(backend.get)
+
+
+def install():
+    """ Подключить замеры шаблонов и кэша; вызывается один раз.
+
+    Обёртка шаблонов ставится, только когда профилирование включено,
+    поэтому в выключенном состоянии она ничего не стоит.
+    """
+    global _installed
+    install_cache()
+    with _install_lock:
+        if _installed:
+            return
+        Template.render = _profiled_render(Template.render)
+        _installed = True
+
+
+class Histograms:
+    """ Гистограммы латентности по имени URL в памяти процесса """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def observe(self, name, profile):
+        total_ms = profile.total * 1000
+        with self._lock:
+            entry = self._data.setdefault(name, {
+                'count': 0,
+                'sum_ms': 0.0,
+                'queries': 0,
+                'cache_hits': 0,
+                'cache_misses': 0,
+                'buckets': [0] * (len(BUCKETS_MS) + 1),
+            })
+            entry['count'] += 1
+            entry['sum_ms'] += total_ms
+            entry['queries'] += profile.queries
+            entry['cache_hits'] += profile.cache_hits
+            entry['cache_misses'] += profile.cache_misses
+            for index, bound in enumerate(BUCKETS_MS):
+                if total_ms <= bound:
+                    break
+            else:
+                index = len(BUCKETS_MS)
+            entry['buckets'][index] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry, buckets=list(entry['buckets']))
+                    for name, entry in self._data.items()}
+
+    def drain(self):
+        """ Забрать накопленное и начать с нуля """
+        with self._lock:
+            data, self._data = self._data, {}
+        return data
+
+    def merge(self, data):
+        """ Вернуть забранное drain(), например после неудачной записи """
+        with self._lock:
+            for name, entry in data.items():
+                current = self._data.setdefault(name, entry)
+                if current is entry:
+                    continue
+                for key, value in entry.items():
+                    if key == 'buckets':
+                        current[key] = [
+                            a + b for a, b in zip(current[key], value)]
+                    else:
+                        current[key] += value
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+histograms = Histograms()
@@ -0,0 +1,80 @@
+import hashlib
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+LOCK_SUFFIX = ':lock'
+# Как часто проверять, не досчитал ли значение другой воркер, в секундах
+POLL_INTERVAL = 0.05
+
+
+def fragment_key(name, vary_on):
+    """ Ключ фрагмента шаблона для {% swrcache %} """
+    digest = hashlib.md5(
+        ':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return 'template.swrcache.{}.{}'.format(name, digest)
+
+
+def is_fresh(entry, version, beta):
+    """ Можно ли отдать запись без пересчёта.
+
+    Вероятностное раннее истечение (XFetch): чем ближе срок и чем дольше
+    считалось значение, тем вероятнее, что один из запросов обновит его
+    заранее, и срок не истечёт у всех воркеров одновременно.
+    """
+    value, entry_version, expires, delta = entry
+    if entry_version != version:
+        return False
+    jitter = delta * beta * -math.log(1 - random.random())
+    return time.time() + jitter < expires
+
+
+def wait_for(key, version, timeout):
+    """ Дождаться значения, которое считает другой воркер """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry[1] == version:
+            return entry
+    return None
+
+
+def get_or_compute(key, compute, timeout, version=None, stale_timeout=None,
+                   beta=None):
+    """ Значение из кэша или compute(), без лавины пересчётов.
+
+    Устаревшее значение (истёк timeout или сменилась version) хранится
+    ещё stale_timeout секунд. Пересчитывает его один воркер, взявший
+    блокировку; остальные в это время получают устаревшее значение,
+    а если его нет — ждут результат до STAMPEDE_LOCK_TIMEOUT секунд.
+    """
+    if stale_timeout is None:
+        stale_timeout = settings.STAMPEDE_STALE_TIMEOUT
+    if beta is None:
+        beta = settings.STAMPEDE_BETA
+    entry = cache.get(key)
+    if entry is not None and is_fresh(entry, version, beta):
+        return entry[0]
+    lock_key = key + LOCK_SUFFIX
+    lock_timeout = settings.STAMPEDE_LOCK_TIMEOUT
+    if not cache.add(lock_key, True, lock_timeout):
+        if entry is not None:
+            return entry[0]
+        entry = wait_for(key, version, lock_timeout)
+        if entry is not None:
+            return entry[0]
+        # Пересчёт завис или упал: считаем сами, не сохраняя
+        return compute()
+    try:
+        started = time.perf_counter()
+        value = compute()
+        delta = time.perf_counter() - started
+        cache.set(key, (value, version, time.time() + timeout, delta),
+                  timeout + stale_timeout)
+    finally:
+        cache.delete(lock_key)
+    return value
@@ -0,0 +1,19 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.edge import marker, render_fragment
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def edge(context, name, **kwargs):
+    """ Персональный фрагмент страницы из core.edge.
+
+    При рендере общей для всех части страницы выводит метку, иначе
+    сразу сам фрагмент.
+    """
+    request = context.get('request')
+    if getattr(request, 'edge_shared', False):
+        return mark_safe(marker(name, kwargs))
+    return render_fragment(request, name, kwargs)
@@ -0,0 +1,57 @@
+from django import template
+
+from core.stampede import fragment_key, get_or_compute
+
+register = template.Library()
+
+VERSION_PREFIX = 'version='
+
+
+class SWRCacheNode(template.Node):
+
+    def __init__(self, nodelist, timeout, name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        try:
+            timeout = int(self.timeout.resolve(context))
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                '"swrcache" tag got a non-integer timeout value')
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        version = self.version.resolve(context) if self.version else None
+        return get_or_compute(
+            fragment_key(self.name, vary_on),
+            lambda: self.nodelist.render(context),
+            timeout, version=version)
+
+
+@register.tag
+def swrcache(parser, token):
+    """ Как {% cache %}, но без лавины пересчётов при истечении.
+
+    {% swrcache timeout name [vary_on ...] [version=expr] %}
+    Смена version делает фрагмент устаревшим: его пересчитывает один
+    запрос, остальные пока получают прежнюю версию.
+    """
+    nodelist = parser.parse(('endswrcache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    tag_name, bits = bits[0], bits[1:]
+    version = None
+    if bits and bits[-1].startswith(VERSION_PREFIX):
+        version = parser.compile_filter(bits.pop()[len(VERSION_PREFIX):])
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            '"{}" tag requires at least 2 arguments.'.format(tag_name))
+    return SWRCacheNode(
+        nodelist,
+        parser.compile_filter(bits[0]),
+        bits[1],
+        [parser.compile_filter(bit) for bit in bits[2:]],
+        version,
+    )
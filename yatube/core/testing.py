@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+# Общий уровень кэша на время тестов: в памяти процесса, а не в файле
+# cache.sqlite3 сервера и прошлых прогонов
+TEST_SHARED_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'yatube-tests',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+
+def memory_caches():
+    """ settings.CACHES, в которых общий уровень заменён памятью """
+    return override_settings(
+        CACHES=dict(settings.CACHES, shared=TEST_SHARED_CACHE))
+
+
+class TestRunner(DiscoverRunner):
+    """ manage.py test с кэшем в памяти (memory_caches) """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.caches = memory_caches()
+        self.caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches.disable()
+        super().teardown_test_environment(**kwargs)
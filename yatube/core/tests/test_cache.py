@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from core.cache import SQLiteCache
+
+CACHE_DIR = tempfile.mkdtemp()
+
+
+def make_cache(**options):
+    return SQLiteCache(
+        os.path.join(CACHE_DIR, 'cache.sqlite3'), {'OPTIONS': options})
+
+
+def increment(times):
+    cache = make_cache()
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.cache = make_cache()
+        self.cache.clear()
+
+    def test_basic_operations(self):
+        """ set/get/add/delete/get_many/set_many как у кэшей Django """
+        cache = self.cache
+        cache.set('key', {'a': 1})
+        self.assertEqual(cache.get('key'), {'a': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        cache.set_many({'one': 1, 'two': 2})
+        self.assertEqual(cache.get_many(['one', 'two', 'missing']),
+                         {'one': 1, 'two': 2})
+        cache.delete('one')
+        self.assertIsNone(cache.get('one'))
+        self.assertEqual(cache.get('one', 'default'), 'default')
+        self.assertTrue(cache.has_key('two'))
+        self.assertEqual(cache.incr('two', 5), 7)
+        self.assertEqual(cache.decr('two'), 6)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+
+    def test_expiration(self):
+        """ Просроченные записи не читаются и не мешают add """
+        self.cache.set('key', 'value', timeout=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'fresh'))
+        self.assertEqual(self.cache.get('key'), 'fresh')
+
+    def test_shared_between_processes(self):
+        """ Записи и атомарный incr видны всем процессам """
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=increment, args=(50,))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_lru_eviction_by_entries(self):
+        """ Сверх MAX_ENTRIES вытесняются давно не читавшиеся записи """
+        cache = make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for index in range(3):
+            cache.set(index, index)
+        # Первая запись прочитана последней и должна остаться
+        cache.connection.execute(
+            'UPDATE cache SET accessed = accessed - 10 '
+            'WHERE key != ?', (cache.make_key(0),))
+        cache.set(3, 3)
+        self.assertEqual(cache.get(0), 0)
+        self.assertEqual(cache.get(3), 3)
+        self.assertEqual(len(cache.get_many(range(4))), 3)
+
+    def test_size_cap(self):
+        """ Суммарный размер значений не превышает MAX_SIZE """
+        cache = make_cache(MAX_SIZE=10000)
+        for index in range(20):
+            cache.set(index, 'x' * 1000)
+        size = cache.connection.execute(
+            'SELECT bytes FROM cache_totals').fetchone()[0]
+        self.assertLessEqual(size, 10000)
+        self.assertEqual(cache.get(19), 'x' * 1000)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'tiered-lower',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 2,
+            'LOCAL_BYPASS': ('version:',),
+        },
+    },
+    'tiered-lower': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-lower',
+    },
+})
+class TieredCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.cache.reset_stats()
+        self.lower = caches['tiered-lower']
+
+    def test_hot_keys_served_from_process(self):
+        """ Повторное чтение не доходит до нижнего уровня """
+        self.lower.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.lower.set('key', 'changed elsewhere')
+        self.assertEqual(self.cache.get('key'), 'value')
+        stats = self.cache.stats()
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['lower_hits'], 1)
+        self.assertEqual(stats['local_hit_rate'], 0.5)
+
+    def test_local_tier_is_bounded_lru(self):
+        """ В памяти не больше LOCAL_MAX_ENTRIES последних записей """
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        self.lower.set('a', 'lower')
+        self.assertEqual(self.cache.get('a'), 'lower')
+
+    def test_local_timeout(self):
+        """ Запись в памяти живёт не дольше LOCAL_TIMEOUT """
+        self.cache.local_timeout = 0
+        self.cache.set('key', 'value')
+        self.lower.set('key', 'changed elsewhere')
+        self.assertEqual(self.cache.get('key'), 'changed elsewhere')
+
+    def test_version_keys_read_from_lower_tier(self):
+        """ Увеличение версии в другом процессе видно сразу """
+        self.cache.set('version:feed', 1)
+        self.assertEqual(self.cache.get('version:feed'), 1)
+        self.lower.incr('version:feed')
+        self.assertEqual(self.cache.get('version:feed'), 2)
+        self.assertEqual(self.cache.incr('version:feed'), 3)
+
+    def test_mutable_values_are_copied(self):
+        """ Изменение полученного значения не портит кэш """
+        self.cache.set('list', [1])
+        self.cache.get('list').append(2)
+        self.assertEqual(self.cache.get('list'), [1])
+        self.assertEqual(self.cache.get_many(['list', 'missing']),
+                         {'list': [1]})
@@ -0,0 +1,100 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core import metrics, profiling
+
+METRICS_DIR = tempfile.mkdtemp()
+METRICS_DB = os.path.join(METRICS_DIR, 'metrics.sqlite3')
+
+
+@override_settings(METRICS_DB=METRICS_DB, METRICS_FLUSH_INTERVAL=0)
+class MetricsTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    def setUp(self):
+        metrics.store.pending.reset()
+        if os.path.exists(METRICS_DB):
+            metrics.store.connect().execute('DELETE FROM metrics')
+
+    def profile(self, total, queries=1, hits=0, misses=0):
+        profile = profiling.RequestProfile()
+        profile.total = total
+        profile.queries = queries
+        profile.cache_hits = hits
+        profile.cache_misses = misses
+        return profile
+
+    def test_workers_are_merged(self):
+        """ Замеры разных процессов складываются в общем файле """
+        first, second = metrics.MetricsStore(), metrics.MetricsStore()
+        first.record('posts:index', self.profile(0.003, hits=1))
+        second.record('posts:index', self.profile(0.2, misses=1))
+        second.record('posts:profile', self.profile(9))
+        result = first.collect()
+        self.assertEqual(result['posts:index']['count'], 2)
+        self.assertEqual(result['posts:index']['queries'], 2)
+        self.assertEqual(result['posts:index']['bucket_5'], 1)
+        self.assertEqual(result['posts:index']['bucket_250'], 1)
+        self.assertEqual(result['posts:profile']['bucket_inf'], 1)
+
+    def test_flush_error_keeps_metrics(self):
+        """ Занятый файл метрик не роняет запрос, замеры не теряются """
+        store = metrics.MetricsStore()
+        locked = sqlite3.OperationalError('database is locked')
+        with mock.patch.object(store, '_write', side_effect=locked):
+            with self.assertLogs('core.metrics', 'ERROR'):
+                store.record('posts:index', self.profile(0.003))
+                store.record('posts:index', self.profile(0.2))
+        result = store.collect()
+        self.assertEqual(result['posts:index']['count'], 2)
+        self.assertEqual(result['posts:index']['bucket_5'], 1)
+        self.assertEqual(result['posts:index']['bucket_250'], 1)
+
+    def test_prometheus_format(self):
+        """ Гистограмма накопительная, есть счётчики и доля попаданий """
+        text = metrics.render_prometheus({'posts:index': {
+            'count': 2, 'sum_ms': 203, 'queries': 4,
+            'cache_hits': 1, 'cache_misses': 3,
+            'bucket_5': 1, 'bucket_250': 1,
+        }})
+        for line in (
+            '# TYPE yatube_request_duration_seconds histogram',
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="0.005"} 1',
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="0.1"} 1',
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 2',
+            'yatube_request_duration_seconds_sum{view="posts:index"} 0.203',
+            'yatube_requests_total{view="posts:index"} 2',
+            'yatube_db_queries_total{view="posts:index"} 4',
+            'yatube_cache_hit_ratio{view="posts:index"} 0.25',
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, text.splitlines())
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """ /metrics видит только staff, запросы воркера попадают в ответ
+        и без профилирования """
+        client = Client()
+        staff = User.objects.create_user('staff', is_staff=True)
+        client.get(reverse('posts:index'))
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+        client.force_login(staff)
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('yatube_requests_total{view="posts:index"} 1',
+                      response.content.decode())
@@ -0,0 +1,37 @@
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core import profiling
+
+
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        profiling.histograms.reset()
+
+    def test_disabled_by_default(self):
+        """ Без PROFILING_ENABLED заголовка Server-Timing нет """
+        response = Client().get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_server_timing_and_histograms(self):
+        """ Замеры попадают в Server-Timing, лог и гистограммы """
+        client = Client()
+        with self.assertLogs('core.profiling', 'INFO') as logs:
+            response = client.get(reverse('posts:index'))
+            client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'cache;desc=', 'total;dur='):
+            with self.subTest(metric=metric):
+                self.assertIn(metric, timing)
+        self.assertNotIn('"0 queries"', timing)
+        self.assertIn('"view": "posts:index"', logs.output[0])
+        # Второй запрос берёт фрагмент ленты из кэша
+        self.assertIn('"cache_hits": 0', logs.output[0])
+        self.assertNotIn('"cache_hits": 0', logs.output[1])
+        entry = profiling.histograms.snapshot()['posts:index']
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(sum(entry['buckets']), 2)
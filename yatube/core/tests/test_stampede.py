@@ -0,0 +1,68 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+
+from core import stampede
+
+
+class StampedeTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.compute = mock.Mock(return_value='fresh')
+
+    def store(self, version=1, expires_in=60, delta=0.01):
+        cache.set('key', ('stale', version, time.time() + expires_in, delta))
+
+    def test_fresh_value_is_not_recomputed(self):
+        self.store()
+        self.assertEqual(
+            stampede.get_or_compute('key', self.compute, 60, version=1),
+            'stale')
+        self.compute.assert_not_called()
+
+    def test_one_worker_recomputes_others_get_stale(self):
+        """ Пока один воркер пересчитывает, остальным отдаётся старое """
+        self.store(version=1)
+        cache.add('key' + stampede.LOCK_SUFFIX, True)
+        self.assertEqual(
+            stampede.get_or_compute('key', self.compute, 60, version=2),
+            'stale')
+        self.compute.assert_not_called()
+        cache.delete('key' + stampede.LOCK_SUFFIX)
+        self.assertEqual(
+            stampede.get_or_compute('key', self.compute, 60, version=2),
+            'fresh')
+        self.assertEqual(cache.get('key')[:2], ('fresh', 2))
+        self.assertIsNone(cache.get('key' + stampede.LOCK_SUFFIX))
+
+    def test_probabilistic_early_expiration(self):
+        """ Долгий пересчёт обновляется до истечения срока """
+        self.assertTrue(stampede.is_fresh(('v', 1, time.time() + 1, 0), 1, 1))
+        self.assertFalse(
+            stampede.is_fresh(('v', 1, time.time() + 1, 10 ** 6), 1, 1))
+        self.assertFalse(stampede.is_fresh(('v', 1, time.time() - 1, 0), 1, 1))
+
+    @override_settings(STAMPEDE_LOCK_TIMEOUT=0.1)
+    def test_waits_for_holder_without_stale_value(self):
+        """ Без старого значения ждём пересчёт, потом считаем сами """
+        cache.add('key' + stampede.LOCK_SUFFIX, True, 60)
+        self.assertEqual(
+            stampede.get_or_compute('key', self.compute, 60), 'fresh')
+        self.compute.assert_called_once()
+        self.assertIsNone(cache.get('key'))
+
+    def test_template_tag(self):
+        """ {% swrcache %} кэширует фрагмент до смены версии """
+        template = Template(
+            '{% load stampede %}'
+            '{% swrcache 60 fragment page version=version %}'
+            '{{ text }}{% endswrcache %}')
+        render = (lambda **context: template.render(Context(dict(
+            page=1, **context))))
+        self.assertEqual(render(text='first', version=1), 'first')
+        self.assertEqual(render(text='second', version=1), 'first')
+        self.assertEqual(render(text='second', version=2), 'second')
@@ -1,7 +1,11 @@
 from http import HTTPStatus
 
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from .metrics import CONTENT_TYPE, render_prometheus, store
+
 
 def page_not_found(request, exception):
     """ Кастомная страница 404 Ошибки"""
@@ -15,3 +19,10 @@ def page_not_found(request, exception):
 def csrf_failure(request, reason=''):
     """ Кастомная страница 403 Ошибки"""
     return render(request, '403.html')
+
+
+@staff_member_required
+def metrics(request):
+    """ Метрики всех воркеров в формате Prometheus, только для staff """
+    return HttpResponse(
+        render_prometheus(store.collect()), content_type=CONTENT_TYPE)
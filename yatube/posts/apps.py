@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     """ Отвечает за отображение постов и групп"""
     name = 'posts'
+
+    def ready(self):
+        from . import fragments, signals  # noqa: F401
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from . import feed_cache
+from .models import Post, Timeline
+
+COUNT_KEY = 'posts:count:{}'
+
+
+def count_key(model, **filters):
+    """ Ключ счётчика строк: модель и отсортированные условия фильтра """
+    signature = [model._meta.label_lower]
+    signature.extend(
+        '{}={}'.format(field, value)
+        for field, value in sorted(filters.items()))
+    return COUNT_KEY.format(':'.join(signature))
+
+
+def get_count(key, queryset):
+    """ Количество строк из кэша; при промахе — посчитать и запомнить.
+
+    Больше COUNT_ESTIMATE_THRESHOLD строк не считаются: выше порога
+    счётчик — оценка (is_estimate), которую дальше двигают сигналы.
+    """
+    count = cache.get(key)
+    if count is None:
+        count = estimate(queryset)
+        if not cache.add(key, count, settings.COUNT_CACHE_TIMEOUT):
+            count = cache.get(key, count)
+    return count
+
+
+def estimate(queryset):
+    """ Точное число строк до порога, выше — оценка по плотности ключей.
+
+    Первые threshold + 1 строк по убыванию pk занимают отрезок ключей
+    от newest до boundary; весь диапазон ключей выборки заполнен так же
+    плотно. Это три поиска по индексу вместо COUNT по всем строкам.
+    """
+    threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    pks = queryset.order_by('-pk').values_list('pk', flat=True)
+    count = pks[:threshold + 1].count()
+    if count <= threshold:
+        return count
+    newest, boundary = pks[0], pks[threshold]
+    oldest = pks.reverse()[0]
+    return max(count, round(
+        count * (newest - oldest + 1) / (newest - boundary + 1)))
+
+
+def is_estimate(count):
+    """ Счётчик выше порога — оценка, а не точное число строк """
+    return count > settings.COUNT_ESTIMATE_THRESHOLD
+
+
+def change(keys, delta):
+    """ Изменить закэшированные счётчики; отсутствующие пропускаются """
+    for key in keys:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            pass
+
+
+def post_count_keys(author_id, group_id=None):
+    """ Счётчики лент, в которые попадает пост """
+    return [count_key(Post), count_key(Post, author_id=author_id),
+            *group_count_keys(group_id)]
+
+
+def group_count_keys(group_id):
+    return [] if group_id is None else [count_key(Post, group_id=group_id)]
+
+
+def follow_count_key(user_id):
+    """ Счётчик записей Timeline в текущей версии ленты подписок """
+    return count_key(Timeline, user_id=user_id, version=feed_cache.get_version(
+        feed_cache.FOLLOW_VERSION_KEY.format(user_id)))
+
+
+def follow_count_keys(user_ids):
+    """ Счётчики лент подписок; у лент без версии в кэше нет и счётчика """
+    version_keys = {
+        feed_cache.FOLLOW_VERSION_KEY.format(user_id): user_id
+        for user_id in user_ids}
+    return [count_key(Timeline, user_id=version_keys[key], version=version)
+            for key, version in cache.get_many(version_keys).items()]
+
+
+def follow_changed(user_id, delta=None):
+    """ Подписка изменила ленту: её версия растёт, а счётчик записей
+    переходит к новой версии, изменившись на delta. None — счётчик
+    не переносится и будет посчитан заново """
+    count = None
+    if delta is not None:
+        count = cache.get(follow_count_key(user_id))
+    feed_cache.bump_follow_version(user_id)
+    if count is not None:
+        cache.set(follow_count_key(user_id), count + delta,
+                  settings.COUNT_CACHE_TIMEOUT)
+
+
+def drop_follow_counts(user_ids):
+    """ Лента изменилась у всех подписчиков автора — пересчитать """
+    cache.delete_many(follow_count_keys(user_ids))
@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import page_cache
+
+POSTS_VERSION_KEY = 'posts:version:posts'
+FOLLOW_VERSION_KEY = 'posts:version:follow:{}'
+
+# Теги страниц в кэше для анонимов и условного GET (core.page_cache).
+# Группа и автор помечаются slug и username: так теги страницы
+# известны по URL, без запроса к базе
+POSTS_TAG = 'posts'
+POST_TAG = 'post:{}'
+AUTHOR_TAG = 'author:{}'
+GROUP_TAG = 'group:{}'
+
+
+def get_version(key):
+    """ Текущая версия; после вытеснения из кэша начинается с нового числа,
+    чтобы не вернуться к версии уже закэшированных фрагментов """
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    """ Увеличить версию, сделав закэшированные фрагменты устаревшими """
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(key)
+
+
+def bump_posts_version():
+    bump_version(POSTS_VERSION_KEY)
+
+
+def bump_follow_version(user_id):
+    bump_version(FOLLOW_VERSION_KEY.format(user_id))
+
+
+def feed_context(user=None):
+    """ Версия ленты и TTL для {% cache %} в шаблонах лент """
+    version = str(get_version(POSTS_VERSION_KEY))
+    if user is not None:
+        version += '.{}'.format(
+            get_version(FOLLOW_VERSION_KEY.format(user.pk)))
+    return {
+        'feed_version': version,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+    }
+
+
+def post_tags(post, group_slug=None):
+    """ Теги страниц, на которых виден пост """
+    tags = [POSTS_TAG, POST_TAG.format(post.pk),
+            AUTHOR_TAG.format(post.author.username)]
+    slugs = {group_slug}
+    if post.group_id:
+        slugs.add(post.group.slug)
+    tags.extend(GROUP_TAG.format(slug) for slug in slugs - {None})
+    return tags
+
+
+def invalidate_post_pages(post, group_slug=None, feed=True):
+    """ Сбросить страницы с постом; feed=False оставляет главную """
+    tags = post_tags(post, group_slug)
+    if not feed:
+        tags.remove(POSTS_TAG)
+    page_cache.invalidate(*tags)
@@ -0,0 +1,48 @@
+from core.edge import fragment
+
+from . import likes
+from .forms import CommentForm
+from .models import Follow, Like
+
+
+@fragment('feed_switcher', 'posts/includes/switcher.html')
+def feed_switcher(request, index=False, follow_index=False):
+    """ Переключатель лент для авторизованных """
+    return {'index': index, 'follow_index': follow_index}
+
+
+@fragment('follow_button', 'posts/includes/follow_button.html')
+def follow_button(request, username):
+    """ Кнопка подписки на автора """
+    user = request.user
+    show = user.is_authenticated and user.username != username
+    return {
+        'username': username,
+        'show': show,
+        'following': show and Follow.objects.filter(
+            user=user, author__username=username).exists(),
+    }
+
+
+@fragment('post_edit_link', 'posts/includes/post_edit_link.html')
+def post_edit_link(request, post_id, author_id):
+    """ Ссылка на редактирование для автора поста """
+    return {'post_id': post_id, 'show': request.user.pk == author_id}
+
+
+@fragment('comment_form', 'posts/includes/comment_form.html')
+def comment_form(request, post_id):
+    """ Форма комментария с CSRF-токеном пользователя """
+    return {'post_id': post_id, 'comment_form': CommentForm()}
+
+
+@fragment('like_button', 'posts/includes/like_button.html')
+def like_button(request, post_id, like_count):
+    """ Число лайков и кнопка лайка; like_count — значение из базы """
+    user = request.user
+    return {
+        'post_id': post_id,
+        'like_count': likes.like_count(post_id, like_count),
+        'liked': user.is_authenticated and Like.objects.filter(
+            user=user, post_id=post_id).exists(),
+    }
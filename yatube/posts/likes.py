@@ -0,0 +1,155 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core import page_cache
+
+from .feed_cache import POST_TAG
+from .models import Like, Post
+
+LIKES_KEY = 'posts:likes:{}'
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    """ Отложенная запись счётчиков лайков (write-behind).
+
+    Приращения копятся в памяти процесса по постам и пишутся в
+    Post.like_count одной транзакцией раз в LIKES_FLUSH_INTERVAL
+    миллисекунд или каждые LIKES_FLUSH_EVENTS событий: вместо UPDATE
+    на каждый клик — один UPDATE на пост с суммарным приращением.
+    Срок проверяется и по окончании каждого запроса (flush_if_due),
+    так что затихший процесс не держит приращения дольше интервала.
+    Незаписанное при падении процесса восстанавливает replay().
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.events = 0
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        atexit.register(self.flush)
+
+    def add(self, post_id, delta):
+        with self._lock:
+            self.pending[post_id] = self.pending.get(post_id, 0) + delta
+            self.events += 1
+            due = (self.events >= settings.LIKES_FLUSH_EVENTS
+                   or self._interval_elapsed())
+        if due:
+            self.flush()
+
+    def _interval_elapsed(self):
+        return ((time.monotonic() - self._flushed) * 1000
+                >= settings.LIKES_FLUSH_INTERVAL)
+
+    def flush_if_due(self):
+        """ Записать накопленное, если прошёл LIKES_FLUSH_INTERVAL """
+        with self._lock:
+            due = bool(self.pending) and self._interval_elapsed()
+        if due:
+            self.flush()
+
+    def delta(self, post_id):
+        """ Ещё не записанное приращение поста в этом процессе """
+        return self.pending.get(post_id, 0)
+
+    def flush(self):
+        """ Записать накопленное одной транзакцией.
+
+        Ошибка базы не выходит наружу: лайк уже сохранён, и ответ
+        на него не должен стать 500. Приращения остаются в буфере
+        до следующей попытки.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self.events = 0
+            self._flushed = time.monotonic()
+        # Посты с одинаковым приращением — одним UPDATE
+        by_delta = {}
+        for post_id, delta in pending.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(post_id)
+        if not by_delta:
+            return
+        try:
+            with transaction.atomic():
+                for delta, post_ids in by_delta.items():
+                    queryset = Post.objects.filter(pk__in=post_ids)
+                    if delta < 0:
+                        queryset = queryset.filter(like_count__gte=-delta)
+                    queryset.update(like_count=F('like_count') + delta)
+        except Exception:
+            logger.exception('Like counters flush failed, will retry')
+            with self._lock:
+                for post_id, delta in pending.items():
+                    self.pending[post_id] = (
+                        self.pending.get(post_id, 0) + delta)
+
+
+buffer = LikeBuffer()
+
+
+def like(user, post_id):
+    """ Поставить лайк; повторный ничего не меняет. True, если новый """
+    try:
+        with transaction.atomic():
+            Like.objects.create(user=user, post_id=post_id)
+    except IntegrityError:
+        return False
+    changed(post_id, 1)
+    return True
+
+
+def unlike(user, post_id):
+    """ Убрать лайк. True, если он был """
+    deleted, _ = Like.objects.filter(user=user, post_id=post_id).delete()
+    if deleted:
+        changed(post_id, -1)
+    return bool(deleted)
+
+
+def changed(post_id, delta):
+    buffer.add(post_id, delta)
+    try:
+        cache.incr(LIKES_KEY.format(post_id), delta)
+    except ValueError:
+        # Счётчика в кэше нет: прочитается из базы при показе
+        pass
+    # Иначе условный GET вернул бы 304 со старым состоянием кнопки
+    page_cache.invalidate(POST_TAG.format(post_id))
+
+
+def like_count(post_id, stored):
+    """ Число лайков из кэша.
+
+    stored — Post.like_count; при промахе кэша к нему добавляется
+    незаписанное приращение процесса, без запроса к базе.
+    """
+    key = LIKES_KEY.format(post_id)
+    count = cache.get(key)
+    if count is None:
+        count = stored + buffer.delta(post_id)
+        if not cache.add(key, count, settings.LIKES_CACHE_TIMEOUT):
+            count = cache.get(key, count)
+    return count
+
+
+def replay():
+    """ Пересчитать like_count всех постов по строкам Like.
+
+    Восстанавливает приращения, потерянные при падении процесса
+    до записи буфера. Возвращает число постов.
+    """
+    buffer.flush()
+    counts = Like.objects.filter(post=OuterRef('pk')).order_by(
+    ).values('post').annotate(total=Count('pk')).values('total')
+    return Post.objects.update(like_count=Coalesce(Subquery(counts), 0))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import process_jobs
+
+
+class Command(BaseCommand):
+    """ Воркер очереди генерации миниатюр """
+    help = 'Генерирует миниатюры картинок постов из очереди заданий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument(
+            '--sleep', type=float, default=2,
+            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_jobs(batch_size=options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(
+            self.style.SUCCESS('Обработано заданий: {}'.format(total)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import rebuild
+
+
+class Command(BaseCommand):
+    """ Пересборка полнотекстового индекса постов """
+    help = 'Пересобирает поисковый индекс FTS5 по текстам постов'
+
+    def handle(self, *args, **options):
+        total = rebuild()
+        self.stdout.write(
+            self.style.SUCCESS('Проиндексировано постов: {}'.format(total)))
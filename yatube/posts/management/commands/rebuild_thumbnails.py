@@ -0,0 +1,110 @@
+import os
+import time
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import make_thumbnails
+
+
+def rebuild_chunk(chunk):
+    """ Обработка пачки картинок в процессе пула """
+    created = failed = 0
+    for name in chunk:
+        try:
+            created += make_thumbnails(name)
+        except Exception:
+            failed += 1
+    return created, failed
+
+
+class Command(BaseCommand):
+    """ Массовая пересборка миниатюр картинок постов """
+    help = ('Генерирует недостающие миниатюры всех картинок постов '
+            'в пуле процессов; прерванный запуск продолжается с места '
+            'остановки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=20)
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR,
+                                 '.rebuild_thumbnails'),
+            help='Файл с id последнего обработанного поста')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, игнорируя checkpoint')
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, path, last_pk):
+        with open(path + '.tmp', 'w') as checkpoint:
+            checkpoint.write(str(last_pk))
+        os.replace(path + '.tmp', path)
+
+    def chunks(self, start_pk, size):
+        """ Пачки (последний id, имена картинок) потоком по id """
+        posts = Post.objects.filter(pk__gt=start_pk).exclude(
+            image__isnull=True).exclude(image='').order_by('pk')
+        chunk = []
+        for pk, name in posts.values_list('pk', 'image').iterator():
+            chunk.append(name)
+            if len(chunk) >= size:
+                yield pk, chunk
+                chunk = []
+        if chunk:
+            yield pk, chunk
+
+    def handle(self, *args, **options):
+        path = options['checkpoint']
+        start_pk = 0 if options['restart'] else self.read_checkpoint(path)
+        if start_pk:
+            self.stdout.write('Продолжаем после поста {}'.format(start_pk))
+        # id последнего поста и размер каждой пачки, отданной в пул
+        progress = []
+
+        def names():
+            for last_pk, chunk in self.chunks(start_pk, options['chunk_size']):
+                progress.append((last_pk, len(chunk)))
+                yield chunk
+
+        images = created = failed = 0
+        started = time.monotonic()
+        pool = None
+        if options['processes'] > 1:
+            # Дочерние процессы откроют собственные соединения с БД
+            connections.close_all()
+            pool = Pool(options['processes'])
+            results = pool.imap(rebuild_chunk, names())
+        else:
+            results = map(rebuild_chunk, names())
+        try:
+            for index, (chunk_created, chunk_failed) in enumerate(results):
+                last_pk, size = progress[index]
+                images += size
+                created += chunk_created
+                failed += chunk_failed
+                self.write_checkpoint(path, last_pk)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    'Пост {}: миниатюр {}, ошибок {}, {:.1f} картинок/с'
+                    .format(last_pk, created, failed,
+                            images / elapsed if elapsed else 0))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        if os.path.exists(path):
+            os.remove(path)
+        self.stdout.write(self.style.SUCCESS(
+            'Готово: миниатюр {}, ошибок {}'.format(created, failed)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.stats import recount_all
+
+
+class Command(BaseCommand):
+    """ Пересчёт статистики всех авторов """
+    help = 'Пересчитывает счётчики постов и подписок всех авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = recount_all(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS('Пересчитано авторов: {}'.format(total)))
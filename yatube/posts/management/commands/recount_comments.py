@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.feed_cache import bump_posts_version
+from posts.stats import recount_comments
+
+
+class Command(BaseCommand):
+    """ Пересчёт счётчиков комментариев всех постов """
+    help = 'Пересчитывает comment_count всех постов одним запросом'
+
+    def handle(self, *args, **options):
+        total = recount_comments()
+        # Счётчики выводятся во фрагментах лент
+        bump_posts_version()
+        self.stdout.write(
+            self.style.SUCCESS('Пересчитано постов: {}'.format(total)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.likes import replay
+
+
+class Command(BaseCommand):
+    """ Восстановление счётчиков лайков по строкам Like """
+    help = 'Пересчитывает like_count всех постов одним запросом'
+
+    def handle(self, *args, **options):
+        total = replay()
+        self.stdout.write(
+            self.style.SUCCESS('Пересчитано постов: {}'.format(total)))
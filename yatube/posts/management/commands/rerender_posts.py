@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core import page_cache
+from posts.feed_cache import bump_posts_version
+from posts.models import Comment, Post
+from posts.rendering import rerender
+
+
+class Command(BaseCommand):
+    """ Пересборка сохранённого HTML постов и комментариев """
+    help = ('Пересобирает HTML текстов постов и комментариев, '
+            'полученный прежними версиями рендера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        posts = rerender(Post, options['batch_size'])
+        comments = rerender(Comment, options['batch_size'])
+        if posts or comments:
+            # Старый HTML мог попасть в любую страницу и фрагмент лент
+            bump_posts_version()
+            page_cache.invalidate(page_cache.ALL_TAG)
+        self.stdout.write(self.style.SUCCESS(
+            'Пересобрано постов: {}, комментариев: {}'.format(
+                posts, comments)))
@@ -0,0 +1,288 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from faker import Faker
+from PIL import Image
+
+from posts import search, stats, timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.rendering import RENDERER_VERSION, make_excerpt, render_text
+
+# Сколько разных текстов и картинок сгенерировать заранее:
+# Faker и PIL слишком медленные, чтобы вызывать их на каждую строку
+TEXT_POOL = 2000
+IMAGE_POOL = 20
+# Момент, от которого по умолчанию отсчитываются даты: с ним данные
+# зависят только от --seed и размеров, а не от времени запуска
+EPOCH = '2024-01-01T00:00:00+00:00'
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def zipf_weights(count, alpha):
+    """ Накопленные веса степенного распределения по рангу """
+    return list(accumulate(
+        1 / (rank ** alpha) for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    """ Генератор больших синтетических данных для нагрузочных замеров """
+    help = ('Создаёт пользователей, группы, посты, комментарии и подписки '
+            'пачками bulk_create; результат детерминирован по --seed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument(
+            '--follows', type=float, default=30,
+            help='Среднее число подписок на пользователя')
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Показатель степенного распределения популярности')
+        parser.add_argument(
+            '--images', type=float, default=0,
+            help='Доля постов с картинкой, от 0 до 1')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить посты')
+        parser.add_argument(
+            '--now', default=EPOCH,
+            help='Момент, к которому заканчиваются даты постов (ISO 8601)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересобирать ленты, счётчики и поисковый индекс')
+
+    def handle(self, *args, **options):
+        self.seed = options['seed']
+        self.now = parse_datetime(options['now'])
+        if self.now is None:
+            raise CommandError('--now: ожидается дата и время ISO 8601')
+        if timezone.is_naive(self.now):
+            self.now = timezone.make_aware(self.now)
+        self.user_prefix = 'seed{}_'.format(self.seed)
+        self.group_prefix = 'seed{}-'.format(self.seed)
+        if (User.objects.filter(
+                username__startswith=self.user_prefix).exists()
+                or Group.objects.filter(
+                    slug__startswith=self.group_prefix).exists()):
+            # Имена зависят только от seed: второй запуск повторил бы их
+            raise CommandError(
+                'Данные с --seed {} уже есть в базе, выберите другой seed'
+                .format(self.seed))
+        self.rnd = random.Random(self.seed)
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # Массовая загрузка: не ждём fsync на каждую транзакцию
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+        self.texts = [self.fake.text(max_nb_chars=self.rnd.randint(50, 1500))
+                      for _ in range(TEXT_POOL)]
+        users = self.step('Пользователи', self.seed_users, options['users'])
+        groups = self.step('Группы', self.seed_groups, options['groups'])
+        posts = self.step(
+            'Посты', self.seed_posts, options['posts'], users, groups,
+            options['alpha'], options['images'], options['days'])
+        self.step('Подписки', self.seed_follows, users,
+                  options['follows'], options['alpha'])
+        self.step('Комментарии', self.seed_comments,
+                  options['comments'], users, posts, options['alpha'])
+        if not options['skip_derived']:
+            self.step('Статистика авторов', stats.recount_all)
+            self.step('Счётчики комментариев', stats.recount_comments)
+            self.step('Ленты подписок', timeline.rebuild)
+            self.step('Поисковый индекс', search.rebuild)
+
+    def step(self, title, method, *args):
+        started = time.monotonic()
+        result = method(*args)
+        count = len(result) if isinstance(result, list) else result
+        elapsed = time.monotonic() - started
+        self.stdout.write('{}: {} за {:.1f} с ({:.0f} строк/с)'.format(
+            title, count, elapsed, count / elapsed if elapsed else 0))
+        return result
+
+    def last_pk(self, model):
+        return model.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+
+    def ids_after(self, model, last):
+        """ id строк, вставленных после last.
+
+        SQLite не отдаёт id из bulk_create, но под единственным писателем
+        они идут подряд после прежнего максимума.
+        """
+        return list(model.objects.filter(pk__gt=last).order_by(
+            'pk').values_list('pk', flat=True))
+
+    def insert(self, model, objects):
+        """ bulk_create пачками, каждая в своей транзакции """
+        last = self.last_pk(model)
+        for batch in batches(objects, self.batch_size):
+            with transaction.atomic():
+                # Размер INSERT Django подберёт под лимиты SQLite сам
+                model.objects.bulk_create(batch)
+        return self.ids_after(model, last)
+
+    def insert_rows(self, model, fields, rows):
+        """ Вставка кортежей через executemany для больших таблиц.
+
+        Подготовка экземпляров моделей в bulk_create занимает больше
+        времени, чем сама запись в SQLite; здесь её нет.
+        Возвращает число строк.
+        """
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(model._meta.get_field(name).column)
+                      for name in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        count = 0
+        for batch in batches(rows, self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            count += len(batch)
+        return count
+
+    def adapt_date(self, value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def seed_users(self, count):
+        return self.insert(User, (
+            User(username='{}{}'.format(self.user_prefix, index),
+                 first_name=self.fake.first_name(),
+                 last_name=self.fake.last_name(),
+                 password=UNUSABLE_PASSWORD_PREFIX,
+                 date_joined=self.now)
+            for index in range(count)
+        ))
+
+    def seed_groups(self, count):
+        return self.insert(Group, (
+            Group(title=self.fake.catch_phrase()[:200],
+                  slug='{}{}'.format(self.group_prefix, index),
+                  description=self.rnd.choice(self.texts))
+            for index in range(count)
+        ))
+
+    def seed_images(self):
+        """ Небольшой набор картинок, общий для всех постов """
+        names = []
+        for index in range(IMAGE_POOL):
+            name = 'posts/seed_{}.png'.format(index)
+            # Цвет выбирается и для готовой картинки: иначе следующие
+            # случайные числа зависели бы от содержимого хранилища
+            color = tuple(self.rnd.randrange(256) for _ in range(3))
+            if not default_storage.exists(name):
+                content = io.BytesIO()
+                Image.new('RGB', (1200, 800), color).save(content, 'PNG')
+                name = default_storage.save(
+                    name, ContentFile(content.getvalue()))
+            names.append(name)
+        return names
+
+    def seed_posts(self, count, users, groups, alpha, images, days):
+        # Активность авторов — степенное распределение
+        authors = self.rnd.sample(users, len(users))
+        weights = zipf_weights(len(authors), alpha)
+        image_names = self.seed_images() if images else []
+        # Даты растут вместе с id: дата поста восстанавливается по индексу
+        start = self.posts_start = self.now - timedelta(days=days)
+        step = self.posts_step = timedelta(days=days) / max(count, 1)
+
+        # Производные от текста поля — один раз на текст из пула
+        rendered = {}
+        for text in self.texts:
+            excerpt, truncated = make_excerpt(text)
+            rendered[text] = (render_text(text), RENDERER_VERSION, excerpt,
+                              render_text(excerpt), truncated)
+
+        def posts():
+            for index in range(count):
+                text = self.rnd.choice(self.texts)
+                yield (
+                    text,
+                    self.rnd.choices(authors, cum_weights=weights)[0],
+                    (self.rnd.choice(groups)
+                     if groups and self.rnd.random() < 0.7 else None),
+                    (self.rnd.choice(image_names)
+                     if image_names and self.rnd.random() < images
+                     else None),
+                    self.adapt_date(start + step * index),
+                    0, 0,
+                    *rendered[text],
+                )
+        last = self.last_pk(Post)
+        # comment_count заполнит шаг «Счётчики комментариев»
+        self.insert_rows(
+            Post, ('text', 'author', 'group', 'image', 'pub_date',
+                   'comment_count', 'like_count', 'text_html',
+                   'render_version', 'excerpt', 'excerpt_html',
+                   'excerpt_truncated'), posts())
+        return self.ids_after(Post, last)
+
+    def seed_follows(self, users, average, alpha):
+        # Популярность авторов — степенное распределение: немногие
+        # собирают большую часть подписчиков
+        authors = self.rnd.sample(users, len(users))
+        weights = zipf_weights(len(authors), alpha)
+
+        def follows():
+            for user in users:
+                wanted = min(len(users) - 1,
+                             int(self.rnd.expovariate(1 / average))
+                             if average else 0)
+                # dict, а не set: порядок подписок — порядок выбора,
+                # а не хэшей id
+                chosen = dict.fromkeys(self.rnd.choices(
+                    authors, cum_weights=weights, k=wanted))
+                chosen.pop(user, None)
+                for author in chosen:
+                    yield user, author
+        return self.insert_rows(Follow, ('user', 'author'), follows())
+
+    def seed_comments(self, count, users, posts, alpha):
+        # Всплески: большая часть комментариев приходится на немногие посты
+        viral = self.rnd.sample(range(len(posts)), len(posts))
+        weights = zipf_weights(len(viral), alpha)
+        rendered = {text: render_text(text[:500]) for text in self.texts}
+
+        def comments():
+            for _ in range(count):
+                index = self.rnd.choices(viral, cum_weights=weights)[0]
+                pub_date = self.posts_start + self.posts_step * index
+                text = self.rnd.choice(self.texts)
+                yield (
+                    posts[index],
+                    self.rnd.choice(users),
+                    text[:500],
+                    self.adapt_date(min(self.now, pub_date + timedelta(
+                        minutes=self.rnd.expovariate(1 / 60)))),
+                    rendered[text],
+                    RENDERER_VERSION,
+                )
+        return self.insert_rows(
+            Comment, ('post', 'author', 'text', 'pub_date', 'text_html',
+                      'render_version'), comments())
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def fill_timeline(apps, schema_editor):
+    """ Заполнение лент подписок по существующим подпискам.
+
+    Авторы с pull-on-read пропускаются, как в timeline.rebuild();
+    AuthorStats ещё нет, подписчики считаются по Follow.
+    """
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    Timeline = apps.get_model('posts', 'Timeline')
+    celebrities = Follow.objects.order_by().values('author').annotate(
+        followers=Count('pk')).filter(
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT).values('author')
+    follows = Follow.objects.exclude(user=None).exclude(
+        author__in=celebrities)
+    for user_id, author_id in follows.values_list(
+            'user_id', 'author_id').iterator():
+        posts = Post.objects.filter(author_id=author_id).order_by(
+            '-pub_date').values_list('pk', 'pub_date')
+        Timeline.objects.bulk_create(
+            (Timeline(user_id=user_id, post_id=pk, author_id=author_id,
+                      pub_date=pub_date)
+             for pk, pub_date in posts[:settings.TIMELINE_BACKFILL]),
+            batch_size=500, ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:17
+
+from django.db import migrations
+
+FTS_TABLE = 'posts_post_fts'
+
+
+def create_index(apps, schema_editor):
+    """ Полнотекстовый индекс FTS5 по тексту постов (только SQLite) """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE {} USING fts5("
+        "text, tokenize='unicode61 remove_diacritics 2')".format(FTS_TABLE))
+    schema_editor.execute(
+        'INSERT INTO {}(rowid, text) SELECT id, text FROM posts_post'
+        .format(FTS_TABLE))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_thumbnail_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from posts.rendering import make_excerpt, render_text
+
+FIELDS = ('excerpt', 'excerpt_html', 'excerpt_truncated')
+
+
+def fill_excerpt(apps, schema_editor):
+    """ Начало текста существующих постов """
+    Post = apps.get_model('posts', 'Post')
+    batch = []
+    for post in Post.objects.only('pk', 'text').iterator():
+        post.excerpt, post.excerpt_truncated = make_excerpt(post.text)
+        post.excerpt_html = render_text(post.excerpt)
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, FIELDS)
+            batch = []
+    Post.objects.bulk_update(batch, FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_excerpt, migrations.RunPython.noop),
+    ]
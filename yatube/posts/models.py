@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.db.models import UniqueConstraint, CheckConstraint
-from django.db import models
+from django.db import models, transaction
+
+from .rendering import RENDERER_VERSION, make_excerpt, render_text
 
 
 class Group(models.Model):
@@ -24,7 +26,86 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class RenderedQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        """ Новый текст — новые производные поля """
+        text = kwargs.get('text')
+        if isinstance(text, str):
+            obj = self.model(text=text)
+            obj.render()
+            kwargs.update({field: getattr(obj, field)
+                           for field in self.model.RENDERED_FIELDS})
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """ bulk_create не вызывает save(): производные поля здесь """
+        objs = list(objs)
+        for obj in objs:
+            obj.render()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class PostQuerySet(RenderedQuerySet):
+    CARD_DEFERRED = ('text', 'text_html', 'excerpt')
+
+    def update(self, **kwargs):
+        """ Посты с новым текстом переиндексируются для поиска """
+        if 'text' not in kwargs:
+            return super().update(**kwargs)
+        # search импортирует models
+        from .search import index_posts
+        with transaction.atomic(savepoint=False):
+            post_ids = list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            index_posts(post_ids)
+        return updated
+
+    def for_cards(self):
+        """ Поля для карточек лент: без полного текста """
+        return self.defer(*self.CARD_DEFERRED)
+
+
+class AtomicSave:
+    """ Запись вместе с post_save-сигналами в одной транзакции.
+
+    Сигналы меняют денормализованные счётчики и ленты: при ошибке
+    они откатываются вместе с самой строкой. Удаление Django и так
+    выполняет вместе с сигналами в транзакции. savepoint=False —
+    внутри уже открытой транзакции лишних SAVEPOINT не будет.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class RenderedText:
+    """ HTML текста, сохранённый при записи.
+
+    Шаблоны выводят text_html как есть, без linebreaksbr на каждый
+    показ. render_version — версия рендера, которым он получен.
+    """
+    RENDERED_FIELDS = ('text_html', 'render_version')
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if 'text' not in self.get_deferred_fields():
+                self.render()
+        elif 'text' in update_fields:
+            self.render()
+            kwargs['update_fields'] = (
+                set(update_fields) | set(self.RENDERED_FIELDS))
+        super().save(*args, **kwargs)
+
+    def render(self):
+        """ Пересчитать поля, производные от текста """
+        self.text_html = render_text(self.text)
+        self.render_version = RENDERER_VERSION
+
+
+class Post(AtomicSave, RenderedText, models.Model):
     """ ORM модель постов """
     text = models.TextField('Текст поста', max_length=15000,
                             help_text='Напишите что нибудь...')
@@ -43,17 +124,49 @@ class Post(models.Model):
                               upload_to='posts/',
                               blank=True,
                               null=True)
+    # Денормализованный счётчик, меняется сигналами комментариев
+    comment_count = models.PositiveIntegerField(
+        'Комментариев', default=0, editable=False)
+    # Пишется с задержкой буфером posts.likes, источник правды — Like
+    like_count = models.PositiveIntegerField(
+        'Лайков', default=0, editable=False)
+    # Считаются из text при сохранении (render), карточки лент
+    # читают только начало текста
+    text_html = models.TextField('HTML текста', blank=True, editable=False)
+    render_version = models.PositiveSmallIntegerField(
+        'Версия рендера', default=0, editable=False)
+    excerpt = models.TextField('Начало текста', blank=True, editable=False)
+    excerpt_html = models.TextField(
+        'HTML начала текста', blank=True, editable=False)
+    excerpt_truncated = models.BooleanField(
+        'Текст обрезан', default=False, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    RENDERED_FIELDS = RenderedText.RENDERED_FIELDS + (
+        'excerpt', 'excerpt_html', 'excerpt_truncated')
 
     class Meta:
         """ Metaclass Post """
         ordering = ('-pub_date',)
         verbose_name_plural = 'Посты'
+        indexes = (
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='post_author_pub_date'),
+            models.Index(fields=('group', '-pub_date', '-id'),
+                         name='post_group_pub_date'),
+        )
 
     def __str__(self):
         return self.text[0:15]
 
+    def render(self):
+        super().render()
+        self.excerpt, self.excerpt_truncated = make_excerpt(self.text)
+        self.excerpt_html = render_text(self.excerpt)
+
 
-class Comment(models.Model):
+class Comment(RenderedText, models.Model):
     """ ORM модель комментариев """
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
                              related_name='comments')
@@ -65,17 +178,45 @@ class Comment(models.Model):
                             help_text='Напишите что нибудь...')
     pub_date = models.DateTimeField('Дата публикации',
                                     auto_now_add=True)
+    text_html = models.TextField('HTML текста', blank=True, editable=False)
+    render_version = models.PositiveSmallIntegerField(
+        'Версия рендера', default=0, editable=False)
+
+    objects = RenderedQuerySet.as_manager()
 
     class Meta:
         """ Metaclass Comment """
         ordering = ('-pub_date',)
         verbose_name_plural = 'Комментарии'
+        indexes = (
+            models.Index(fields=('post', '-pub_date', '-id'),
+                         name='comment_post_pub_date_id'),
+        )
 
     def __str__(self):
         return 'Комментарий от {}'.format(self.author)
 
 
-class Follow(models.Model):
+class Like(models.Model):
+    """ Лайк пользователя посту """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='likes')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='likes')
+    created = models.DateTimeField('Поставлен', auto_now_add=True)
+
+    class Meta:
+        """ Metaclass Like """
+        verbose_name_plural = 'Лайки'
+        constraints = (
+            UniqueConstraint(fields=('user', 'post'), name='unique_like'),
+        )
+
+    def __str__(self):
+        return '{} лайкнул пост {}'.format(self.user, self.post_id)
+
+
+class Follow(AtomicSave, models.Model):
     """ ORM Following модель """
     user = models.ForeignKey(
         User,
@@ -93,11 +234,92 @@ class Follow(models.Model):
     class Meta:
         """ Metaclass Follow """
         verbose_name = 'Лента'
-        UniqueConstraint(fields=['author', 'user'],
-                         name='re-subscription')
-        CheckConstraint(
-            name='prevent_self_follow',
-            check=~models.Q(user=models.F('author')), )
+        constraints = (
+            UniqueConstraint(fields=('user', 'author'),
+                             name='re-subscription'),
+            CheckConstraint(
+                name='prevent_self_follow',
+                check=~models.Q(user=models.F('author')), ),
+        )
+        indexes = (
+            models.Index(fields=('author', 'user'),
+                         name='follow_author_user'),
+        )
 
     def __str__(self):
         return '{} подписан на {}'.format(self.user, self.author)
+
+
+class TimelineQuerySet(models.QuerySet):
+
+    def for_cards(self):
+        """ Записи ленты с постами для карточек """
+        return self.select_related('post__author', 'post__group').defer(
+            *('post__' + field for field in PostQuerySet.CARD_DEFERRED))
+
+
+class Timeline(models.Model):
+    """ Материализованная лента подписок (fan-out-on-write) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField('Дата публикации')
+    objects = TimelineQuerySet.as_manager()
+
+    class Meta:
+        """ Metaclass Timeline """
+        ordering = ('-pub_date',)
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            UniqueConstraint(fields=('user', 'post'),
+                             name='unique_timeline_post'),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-post'),
+                         name='timeline_user_pub_date_post'),
+            models.Index(fields=('user', 'author'),
+                         name='timeline_user_author'),
+        )
+
+    def __str__(self):
+        return 'Пост {} в ленте {}'.format(self.post_id, self.user)
+
+
+class AuthorStats(models.Model):
+    """ Денормализованные счётчики автора для страницы профиля """
+    author = models.OneToOneField(User, on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='stats',
+                                  verbose_name='Автор')
+    posts = models.PositiveIntegerField('Постов', default=0)
+    followers = models.PositiveIntegerField('Подписчиков', default=0,
+                                            db_index=True)
+    following = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        """ Metaclass AuthorStats """
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return 'Статистика {}'.format(self.author)
+
+
+class ThumbnailJob(models.Model):
+    """ Задание очереди на генерацию миниатюры картинки поста """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='thumbnail_jobs')
+    preset = models.CharField('Пресет', max_length=50)
+    created = models.DateTimeField('Создано', auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+
+    class Meta:
+        """ Metaclass ThumbnailJob """
+        ordering = ('pk',)
+        verbose_name_plural = 'Очередь миниатюр'
+
+    def __str__(self):
+        return 'Миниатюра {} для поста {}'.format(self.preset, self.post_id)
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import transaction
+from django.template.defaultfilters import linebreaksbr
+from django.utils.text import Truncator
+
+# Версия render_text: после изменения рендера её увеличивают, и команда
+# rerender_posts пересобирает HTML постов и комментариев старых версий
+RENDERER_VERSION = 1
+
+
+def render_text(text):
+    """ HTML текста, как у фильтра linebreaksbr с экранированием """
+    return str(linebreaksbr(text, autoescape=True))
+
+
+def make_excerpt(text):
+    """ Начало текста для карточки и признак, что текст обрезан """
+    excerpt = Truncator(text).chars(settings.POST_EXCERPT_LENGTH)
+    return excerpt, excerpt != text
+
+
+def rerender(model, batch_size=1000):
+    """ Пересобрать HTML строк model, полученный старыми версиями рендера.
+
+    Идёт пачками по batch_size, каждая в своей транзакции; прерванный
+    запуск продолжается с места остановки. Возвращает число строк.
+    """
+    stale = model.objects.filter(
+        render_version__lt=RENDERER_VERSION).order_by('pk')
+    total = 0
+    while True:
+        with transaction.atomic():
+            batch = list(stale.only('pk', 'text')[:batch_size])
+            for obj in batch:
+                obj.render()
+            model.objects.bulk_update(batch, model.RENDERED_FIELDS)
+        if not batch:
+            return total
+        total += len(batch)
@@ -0,0 +1,111 @@
+import re
+
+from django.db import connection, transaction
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+WORD_RE = re.compile(r'\w+')
+
+
+def enabled():
+    """ FTS5 доступен только на SQLite """
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """ Запрос пользователя в безопасное выражение MATCH.
+
+    Слова берутся в кавычки (AND между ними), последнее — как префикс.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    """ Добавить или обновить пост в индексе """
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [post.pk])
+        cursor.execute(
+            'INSERT INTO {}(rowid, text) VALUES (%s, %s)'.format(FTS_TABLE),
+            [post.pk, post.text])
+
+
+def index_posts(post_ids, batch_size=500):
+    """ Переиндексировать посты по id пачками INSERT ... SELECT """
+    if not enabled():
+        return
+    post_ids = list(post_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(post_ids), batch_size):
+            batch = post_ids[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid IN ({})'.format(
+                    FTS_TABLE, placeholders), batch)
+            cursor.execute(
+                'INSERT INTO {}(rowid, text) SELECT id, text FROM {} '
+                'WHERE id IN ({})'.format(
+                    FTS_TABLE, Post._meta.db_table, placeholders), batch)
+
+
+def unindex_post(post_id):
+    """ Убрать пост из индекса """
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [post_id])
+
+
+@transaction.atomic
+def rebuild():
+    """ Пересобрать индекс по всем постам; возвращает число постов """
+    if not enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        cursor.execute(
+            'INSERT INTO {}(rowid, text) SELECT id, text FROM {}'.format(
+                FTS_TABLE, Post._meta.db_table))
+        cursor.execute(
+            "INSERT INTO {0}({0}) VALUES ('optimize')".format(FTS_TABLE))
+    return Post.objects.count()
+
+
+def filter_posts(queryset, query):
+    """ Посты queryset, подходящие под запрос; без сортировки """
+    match = match_expression(query)
+    if match is None:
+        return queryset.none()
+    if not enabled():
+        return queryset.filter(text__icontains=query)
+    return queryset.extra(
+        where=['{}.id IN (SELECT rowid FROM {} WHERE {} MATCH %s)'.format(
+            Post._meta.db_table, FTS_TABLE, FTS_TABLE)],
+        params=[match],
+    )
+
+
+def search(query):
+    """ Посты по запросу, самые релевантные первыми """
+    match = match_expression(query)
+    if match is None:
+        return Post.objects.none()
+    if not enabled():
+        return Post.objects.filter(text__icontains=query)
+    return Post.objects.extra(
+        tables=[FTS_TABLE],
+        where=['{}.rowid = {}.id'.format(FTS_TABLE, Post._meta.db_table),
+               '{} MATCH %s'.format(FTS_TABLE)],
+        params=[match],
+        select={'rank': '{}.rank'.format(FTS_TABLE)},
+        order_by=['rank', '-pub_date'],
+    )
@@ -0,0 +1,163 @@
+from django.core.signals import request_finished
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from core import page_cache
+
+from . import counts, feed_cache, likes, search, stats, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    """ Рассылка нового поста по лентам, счётчики постов """
+    if created:
+        followers = timeline.fan_out((instance,))
+        stats.change(instance.author_id, 'posts', 1)
+        counts.change(counts.post_count_keys(
+            instance.author_id, instance.group_id), 1)
+        counts.change(counts.follow_count_keys(
+            followers.get(instance.author_id, ())), 1)
+    elif instance.group_id != getattr(
+            instance, 'previous_group_id', instance.group_id):
+        # Пост перешёл в другую группу
+        counts.change(counts.group_count_keys(instance.previous_group_id), -1)
+        counts.change(counts.group_count_keys(instance.group_id), 1)
+
+
+@receiver(pre_delete, sender=Post)
+def post_before_delete(sender, instance, **kwargs):
+    """ Запомнить ленты подписок с постом: записи удалятся каскадом """
+    instance.feed_user_ids = timeline.feed_user_ids(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    """ Уменьшение счётчиков постов автора и лент """
+    stats.change(instance.author_id, 'posts', -1)
+    counts.change(counts.post_count_keys(
+        instance.author_id, instance.group_id), -1)
+    counts.change(counts.follow_count_keys(
+        getattr(instance, 'feed_user_ids', ())), -1)
+
+
+@receiver(pre_save, sender=Post)
+def post_group_before_save(sender, instance, **kwargs):
+    """ Запомнить прежнюю группу: её страница тоже устареет """
+    if instance.pk:
+        instance.previous_group_id, instance.previous_group_slug = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'group__slug').first() or (None, None))
+
+
+@receiver((post_save, post_delete), sender=Post)
+def post_changed(sender, instance, **kwargs):
+    """ Закэшированные ленты и страницы устарели """
+    feed_cache.bump_posts_version()
+    feed_cache.invalidate_post_pages(
+        instance, getattr(instance, 'previous_group_slug', None))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    """ Увеличение счётчика комментариев поста """
+    if created:
+        stats.change_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """ Уменьшение счётчика комментариев поста """
+    stats.change_comment_count(instance.post_id, -1)
+
+
+@receiver((post_save, post_delete), sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    """ Страницы поста, его автора и группы устарели.
+
+    Версия лент не меняется: счётчик комментариев на карточках главной
+    и ленты подписок может отставать на время жизни их кэша.
+    """
+    if Comment.post.is_cached(instance):
+        post = instance.post
+    else:
+        post = Post.objects.select_related('author', 'group').filter(
+            pk=instance.post_id).first()
+    if post is None:
+        return
+    feed_cache.invalidate_post_pages(post, feed=False)
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """ Страница группы устарела """
+    page_cache.invalidate(feed_cache.GROUP_TAG.format(instance.slug))
+
+
+@receiver(post_save, sender=Post)
+def post_saved_to_index(sender, instance, **kwargs):
+    """ Обновление поста в поисковом индексе """
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted_from_index(sender, instance, **kwargs):
+    """ Удаление поста из поискового индекса """
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """ Заполнение ленты при подписке """
+    if created:
+        stats.change(instance.author_id, 'followers', 1)
+        stats.change(instance.user_id, 'following', 1)
+        was_pulled, pulled = timeline.followers_changed(
+            instance.author_id, 1)
+        added = 0
+        if not pulled:
+            added = timeline.backfill(instance.author_id, (instance.user_id,))
+        # Посты знаменитости лента считает по счётчику её страницы
+        counts.follow_changed(
+            instance.user_id, added if pulled == was_pulled else None)
+        invalidate_follow_pages(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """ Очистка ленты при отписке """
+    removed = timeline.prune(instance.user_id, instance.author_id)
+    stats.change(instance.author_id, 'followers', -1)
+    stats.change(instance.user_id, 'following', -1)
+    was_pulled, _ = timeline.followers_changed(
+        instance.author_id, -1, loaded_followers(instance, -1))
+    # Записи знаменитости лента не учитывала
+    counts.follow_changed(instance.user_id, 0 if was_pulled else -removed)
+    invalidate_follow_pages(instance)
+
+
+def loaded_followers(follow, delta):
+    """ Подписчики автора после изменения по строке AuthorStats,
+    загруженной вместе с подпиской; None, если её не загружали """
+    if not Follow.author.is_cached(follow):
+        return None
+    if not User.stats.is_cached(follow.author):
+        return None
+    try:
+        return max(follow.author.stats.followers + delta, 0)
+    except AuthorStats.DoesNotExist:
+        return None
+
+
+def invalidate_follow_pages(follow):
+    """ Счётчики подписок в профилях обоих пользователей изменились """
+    page_cache.invalidate(
+        feed_cache.AUTHOR_TAG.format(follow.author.username),
+        feed_cache.AUTHOR_TAG.format(follow.user.username))
+
+
+@receiver(request_finished)
+def flush_likes(sender, **kwargs):
+    """ Буфер лайков пишется и без новых лайков, когда истёк интервал """
+    likes.buffer.flush_if_due()
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import AuthorStats, Comment, Follow, Post, User
+
+
+def count_for(author_id):
+    """ Точные счётчики автора прямыми запросами """
+    return {
+        'posts': Post.objects.filter(author_id=author_id).count(),
+        'followers': Follow.objects.filter(author_id=author_id).count(),
+        'following': Follow.objects.filter(user_id=author_id).count(),
+    }
+
+
+def recount(author_id):
+    """ Пересчитать и сохранить счётчики автора """
+    stats, _ = AuthorStats.objects.update_or_create(
+        author_id=author_id, defaults=count_for(author_id))
+    return stats
+
+
+def get_stats(author):
+    """ Счётчики автора; отсутствующая строка считается один раз """
+    try:
+        return author.stats
+    except AuthorStats.DoesNotExist:
+        return recount(author.pk)
+
+
+def change(author_id, field, delta):
+    """ Атомарно изменить счётчик через F().
+
+    Если строки нет или счётчик ушёл бы в минус, автор пересчитывается
+    целиком. Исключение — уменьшение без строки: так бывает, когда
+    автор удаляется вместе с подписками, и пересчёт создал бы строку
+    заново.
+    """
+    queryset = AuthorStats.objects.filter(author_id=author_id)
+    if delta < 0:
+        queryset = queryset.filter(**{field + '__gte': -delta})
+    if queryset.update(**{field: F(field) + delta}):
+        return
+    if delta > 0 or AuthorStats.objects.filter(author_id=author_id).exists():
+        recount(author_id)
+
+
+def change_comment_count(post_id, delta):
+    """ Атомарно изменить счётчик комментариев поста через F() """
+    queryset = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        queryset = queryset.filter(comment_count__gte=-delta)
+    queryset.update(comment_count=F('comment_count') + delta)
+
+
+def recount_comments():
+    """ Пересчитать счётчики комментариев всех постов одним UPDATE
+    с группирующим подзапросом. Возвращает число постов """
+    counts = Comment.objects.filter(post=OuterRef('pk')).order_by(
+    ).values('post').annotate(total=Count('pk')).values('total')
+    return Post.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+@transaction.atomic
+def recount_all(batch_size=1000):
+    """ Пересчитать счётчики всех авторов группирующими запросами """
+    def grouped(queryset, field):
+        return dict(queryset.values_list(field).annotate(Count('pk')))
+
+    posts = grouped(Post.objects.order_by(), 'author')
+    followers = grouped(Follow.objects.order_by(), 'author')
+    following = grouped(Follow.objects.order_by(), 'user')
+    AuthorStats.objects.all().delete()
+    batch = []
+    total = 0
+    users = User.objects.values_list('pk', flat=True)
+    for user_id in users.iterator():
+        batch.append(AuthorStats(
+            author_id=user_id,
+            posts=posts.get(user_id, 0),
+            followers=followers.get(user_id, 0),
+            following=following.get(user_id, 0),
+        ))
+        if len(batch) >= batch_size:
+            AuthorStats.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    AuthorStats.objects.bulk_create(batch)
+    return total + len(batch)
@@ -0,0 +1,10 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj, on_each_side=3, on_ends=1):
+    """ Номера страниц для ссылок Paginator, пропуски — None """
+    return page_obj.paginator.get_elided_page_range(
+        page_obj.number, on_each_side, on_ends)
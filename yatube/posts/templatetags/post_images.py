@@ -0,0 +1,11 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(image, preset='card'):
+    """ Готовая миниатюра картинки или None, пока её не сделал воркер """
+    return thumbnails.ready_thumbnail(image, preset)
@@ -5,6 +5,7 @@ from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from ...models import Comment, Follow, Group, Post
+from ...timeline import fan_out
 
 User = get_user_model()
 
@@ -83,12 +84,15 @@ def bulk_post():
 
 def second_bulk_post():
     """ Модель Post Bulk Create """
-    return Post.objects.bulk_create(
+    posts = Post.objects.bulk_create(
         [Post(text='Test',
               author=User.objects.get(username='SecondTestUser'),
               group=Group.objects.get(slug='TestSlug')
               ) for objs in range(
             TEST_RANGE + settings.POSTS_ON_MAIN)])
+    # bulk_create не шлёт post_save — раскладываем по лентам вручную
+    fan_out(Post.objects.filter(author__username='SecondTestUser'))
+    return posts
 
 
 def comment():
@@ -0,0 +1,275 @@
+import os
+import shutil
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import F, Sum
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from .fixtures import models
+from ..likes import buffer
+from ..rendering import RENDERER_VERSION
+from ..models import (AuthorStats, Comment, Follow, Group, Like, Post,
+                      ThumbnailJob, Timeline, User)
+from ..search import search
+from ..thumbnails import ready_thumbnail
+
+
+class AuthorStatsTransactionTests(TransactionTestCase):
+    def test_stats_are_transactional(self):
+        """ Строка без счётчиков пересчитывается, ошибка сигнала
+        откатывает пост вместе со счётчиками """
+        models.user()
+        second_user = models.second_user()
+        models.follow()
+        stats = AuthorStats.objects.get(author=second_user)
+        self.assertEqual((stats.posts, stats.followers), (0, 1))
+        with mock.patch('posts.search.index_post',
+                        side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                models.second_post()
+        stats.refresh_from_db()
+        self.assertEqual(stats.posts, 0)
+        self.assertFalse(Post.objects.filter(author=second_user).exists())
+
+
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
+class AuthorStatsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = models.user()
+        cls.second_user = models.second_user()
+        cls.group = models.group()
+        cls.post = models.post()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_profile_uses_stats(self):
+        """ Счётчики профиля обновляются сигналами """
+        response = self.authorized_client.get(
+            reverse('posts:profile', args=(self.second_user.username,)))
+        self.assertEqual(response.context['stats'].posts, 0)
+        models.second_post()
+        models.follow()
+        stats = AuthorStats.objects.get(author=self.second_user)
+        self.assertEqual(
+            (stats.posts, stats.followers, stats.following), (1, 1, 0))
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    args=(self.second_user.username,)))
+        stats.refresh_from_db()
+        self.assertEqual(stats.followers, 0)
+
+    def test_recount_author_stats(self):
+        """ Команда recount_author_stats пересчитывает счётчики """
+        models.follow()
+        models.bulk_post()
+        out = StringIO()
+        call_command('recount_author_stats', stdout=out)
+        stats = AuthorStats.objects.get(author=self.user)
+        self.assertEqual(
+            (stats.posts, stats.followers, stats.following),
+            (1 + models.TEST_RANGE + settings.POSTS_ON_MAIN, 0, 1))
+        self.assertIn('2', out.getvalue())
+
+    def test_comment_count(self):
+        """ Счётчик комментариев меняется сигналами и пересчитывается """
+        comment = models.comment()
+        models.comment()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        Comment.objects.bulk_create(
+            Comment(text='Bulk', author=self.user, post=self.post)
+            for _ in range(3))
+        Post.objects.update(comment_count=0)
+        with self.assertNumQueries(1):
+            call_command('recount_comments', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 4)
+
+    def test_replay_likes(self):
+        """ replay_likes восстанавливает счётчики по строкам Like """
+        Like.objects.bulk_create((Like(user=self.user, post=self.post),
+                                  Like(user=self.second_user, post=self.post)))
+        # Приращение, потерянное вместе с буфером упавшего процесса
+        buffer.pending.clear()
+        call_command('replay_likes', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 2)
+
+    def test_rerender_posts(self):
+        """ rerender_posts пересобирает HTML старых версий рендера """
+        comment = models.comment()
+        self.assertEqual(self.post.text_html, self.post.text)
+        self.assertEqual(comment.text_html, comment.text)
+        Post.objects.update(text_html='', render_version=0)
+        Comment.objects.update(text_html='', render_version=0)
+        detail = reverse('posts:post_detail', args=(self.post.pk,))
+        self.client.get(detail)
+        out = StringIO()
+        call_command('rerender_posts', batch_size=1, stdout=out)
+        self.assertIn('постов: 1, комментариев: 1', out.getvalue())
+        # Страницы со старым HTML сброшены вместе со всем кэшем страниц
+        response = self.client.get(detail)
+        self.assertNotEqual(response.get('X-Page-Cache'), 'hit')
+        self.assertContains(response, comment.text)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(
+            (post.text_html, post.render_version),
+            (self.post.text, RENDERER_VERSION))
+        self.assertEqual(
+            Comment.objects.get(pk=comment.pk).text_html, comment.text)
+        # Актуальные строки не трогаются
+        out = StringIO()
+        call_command('rerender_posts', stdout=out)
+        self.assertIn('постов: 0, комментариев: 0', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = models.user()
+        cls.group = models.group()
+        cls.post = models.post()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_update_reindexes(self):
+        """ update(text=...) обновляет и поисковый индекс """
+        Post.objects.filter(pk=self.post.pk).update(text='Обновлён')
+        self.assertEqual(search('обновлён').get(), self.post)
+        self.assertFalse(search(self.post.text).exists())
+
+    def test_rebuild_search_index(self):
+        """ rebuild_search_index подхватывает изменения в обход сигналов """
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE {} SET text = %s'.format(
+                Post._meta.db_table), ['Переиндексирован'])
+        self.assertFalse(search('Переиндексирован').exists())
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search('переиндексирован').get(), self.post)
+
+
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
+class ThumbnailQueueTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = models.user()
+        cls.group = models.group()
+        cls.post = models.post()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_thumbnails_generated_by_worker(self):
+        """ Миниатюра появляется после process_thumbnails """
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'WithImage', 'image': self.post.image},
+        )
+        post = Post.objects.get(text='WithImage')
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+        self.assertIsNone(ready_thumbnail(post.image, 'card'))
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=(post.id,)))
+        self.assertNotContains(response, '<img class="card-img')
+        call_command('process_thumbnails', once=True, stdout=StringIO())
+        self.assertFalse(ThumbnailJob.objects.exists())
+        self.assertIsNotNone(ready_thumbnail(post.image, 'card'))
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=(post.id,)))
+        self.assertContains(response, '<img class="card-img')
+
+    def test_rebuild_thumbnails(self):
+        """ rebuild_thumbnails создаёт недостающие миниатюры и продолжает
+        с checkpoint """
+        checkpoint = os.path.join(models.TEMP_MEDIA_ROOT, 'checkpoint')
+        with open(checkpoint, 'w') as file:
+            file.write(str(self.post.pk))
+        call_command('rebuild_thumbnails', processes=1,
+                     checkpoint=checkpoint, stdout=StringIO())
+        self.assertIsNone(ready_thumbnail(self.post.image, 'card'))
+        out = StringIO()
+        call_command('rebuild_thumbnails', processes=1,
+                     checkpoint=checkpoint, stdout=out)
+        self.assertIn('миниатюр 1', out.getvalue())
+        self.assertIsNotNone(ready_thumbnail(self.post.image, 'card'))
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class SeedYatubeTests(TestCase):
+
+    def test_seed_yatube(self):
+        """ seed_yatube создаёт данные и пересобирает производные таблицы """
+        call_command('seed_yatube', users=30, groups=3, posts=200,
+                     comments=300, follows=5, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(Follow.objects.exists())
+        self.assertEqual(AuthorStats.objects.count(), 30)
+        self.assertTrue(Timeline.objects.exists())
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        self.assertEqual(Post.objects.aggregate(
+            total=Sum('comment_count'))['total'], 300)
+        # Тот же seed дал бы те же имена, другой добавляет новые данные
+        with self.assertRaises(CommandError):
+            call_command('seed_yatube', users=5, groups=1, posts=10,
+                         comments=0, follows=1, stdout=StringIO())
+        call_command('seed_yatube', users=5, groups=1, posts=10,
+                     comments=0, follows=1, seed=1, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 35)
+
+    def test_seed_yatube_is_deterministic(self):
+        """ Один seed на пустой базе даёт те же строки при каждом запуске """
+        def seed():
+            call_command('seed_yatube', users=20, groups=2, posts=100,
+                         comments=200, follows=3, seed=7, stdout=StringIO())
+            rows = (
+                User.objects.values_list(
+                    'username', 'first_name', 'last_name', 'password',
+                    'date_joined'),
+                Group.objects.values_list('slug', 'title', 'description'),
+                Post.objects.values_list(
+                    'text', 'author__username', 'group__slug', 'image',
+                    'pub_date'),
+                Follow.objects.values_list(
+                    'user__username', 'author__username'),
+                Comment.objects.values_list(
+                    'post__pub_date', 'author__username', 'text',
+                    'pub_date'),
+            )
+            snapshot = [list(queryset.order_by('pk')) for queryset in rows]
+            User.objects.all().delete()
+            Group.objects.all().delete()
+            return snapshot
+
+        self.assertEqual(seed(), seed())
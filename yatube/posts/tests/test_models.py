@@ -1,8 +1,11 @@
-from django.test import TestCase
+import shutil
+
+from django.test import TestCase, override_settings
 
 from .fixtures import models
 
 
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
 class PostModelTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -12,6 +15,11 @@ class PostModelTest(TestCase):
         cls.post = models.post()
         cls.comment = models.comment()
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
     def test_post_have_correct_object_names(self):
         """ Модель Post отображается правильно """
         self.assertEqual(self.post.text[:15], str(self.post))
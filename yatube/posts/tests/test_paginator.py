@@ -1,8 +1,18 @@
+from http import HTTPStatus
+
 from django.conf import settings
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from core import page_cache
+
 from .fixtures import models
+from .. import feed_cache
+from ..models import Follow, Group, Post
+from ..utils import CountingPaginator
 
 
 class PaginatorViewsTest(TestCase):
@@ -14,6 +24,7 @@ class PaginatorViewsTest(TestCase):
         cls.group = models.group()
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
         self.second_authorized_client = Client()
@@ -44,3 +55,162 @@ class PaginatorViewsTest(TestCase):
                     self.assertEqual(
                         len(response.context.get('page_obj').object_list),
                         count)
+
+    def test_cached_feed_skips_query(self):
+        """ Лента из {% swrcache %} не читает посты из базы """
+        models.second_bulk_post()
+        for name in ('posts:index', 'posts:follow_index'):
+            for params in ({}, {'page': models.SECOND_PAGE}):
+                with self.subTest(name=name, params=params):
+                    self.authorized_client.get(reverse(name), params)
+                    # Страница целиком устарела, фрагмент ленты — нет
+                    page_cache.invalidate(feed_cache.POSTS_TAG)
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.authorized_client.get(
+                            reverse(name), params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertFalse(any(
+                        'FROM "posts_post"' in query['sql']
+                        or 'FROM "posts_timeline"' in query['sql']
+                        for query in queries), queries.captured_queries)
+
+    def test_cursor_paginator(self):
+        """ Курсорный Paginator: переходы по токенам без COUNT """
+        url = reverse('posts:index')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries))
+        first_page = response.context['page_obj']
+        self.assertEqual(len(first_page), settings.POSTS_ON_MAIN)
+        self.assertTrue(first_page.has_next())
+        self.assertFalse(first_page.has_previous())
+        response = self.authorized_client.get(
+            url, {'after': first_page.next_cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), models.TEST_RANGE)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(
+            set(first_page.object_list) & set(second_page.object_list))
+        response = self.authorized_client.get(
+            url, {'before': second_page.previous_cursor})
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page))
+        # Битый токен — первая страница
+        response = self.authorized_client.get(url, {'after': 'broken'})
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page))
+
+    def test_cached_count(self):
+        """ Количество постов считается один раз и меняется сигналами """
+        url = reverse('posts:group_list', args=(self.group.slug,))
+        last_page = {'page': models.SECOND_PAGE}
+        self.authorized_client.get(url, {'page': models.FIRST_PAGE})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url, last_page)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries))
+        self.assertEqual(
+            response.context['page_obj'].paginator.count,
+            models.TEST_RANGE + settings.POSTS_ON_MAIN)
+        post = Post.objects.create(
+            text='Extra', author=self.user, group=self.group)
+        response = self.authorized_client.get(url, last_page)
+        self.assertEqual(len(response.context['page_obj']),
+                         models.TEST_RANGE + 1)
+        # Переход в другую группу и удаление уменьшают счётчик
+        post.group = Group.objects.create(title='Other', slug='other')
+        post.save()
+        Post.objects.filter(group=self.group).first().delete()
+        response = self.authorized_client.get(url, last_page)
+        self.assertEqual(len(response.context['page_obj']),
+                         models.TEST_RANGE - 1)
+
+    def test_follow_count(self):
+        """ Счётчик ленты подписок меняется сигналами, а не пересчётом """
+        models.second_bulk_post()
+        url = reverse('posts:follow_index')
+        first_page = {'page': models.FIRST_PAGE}
+        total = models.TEST_RANGE + settings.POSTS_ON_MAIN
+        third_user = models.third_user()
+        Post.objects.create(text='Extra', author=third_user)
+
+        def follow_count():
+            with CaptureQueriesContext(connection) as queries:
+                count = self.authorized_client.get(
+                    url, first_page).context['page_obj'].paginator.count
+            self.assertFalse(
+                any('COUNT(' in query['sql'] for query in queries))
+            return count
+
+        self.authorized_client.get(url, first_page)
+        # Посты вне ленты счётчик не сбрасывают
+        Post.objects.create(text='Own', author=self.user)
+        self.assertEqual(follow_count(), total)
+        post = Post.objects.create(text='New', author=self.second_user)
+        self.assertEqual(follow_count(), total + 1)
+        post.delete()
+        self.assertEqual(follow_count(), total)
+        Follow.objects.create(user=self.user, author=third_user)
+        self.assertEqual(follow_count(), total + 1)
+        Follow.objects.filter(user=self.user, author=third_user).delete()
+        self.assertEqual(follow_count(), total)
+
+    @override_settings(COUNT_ESTIMATE_THRESHOLD=3)
+    def test_estimated_count(self):
+        """ Выше порога количество оценивается, а страницы не теряются """
+        total = models.TEST_RANGE + settings.POSTS_ON_MAIN
+        url = reverse('posts:index')
+        response = self.authorized_client.get(
+            url, {'page': models.FIRST_PAGE})
+        paginator = response.context['page_obj'].paginator
+        self.assertTrue(paginator.estimated)
+        self.assertEqual(paginator.count, total)
+        self.assertNotContains(response, 'Последняя')
+        # После удаления постов из середины оценка завышена: последняя
+        # страница и точное количество находятся по её строкам
+        deleted = models.TEST_RANGE - 2
+        Post.objects.filter(pk__in=Post.objects.order_by(
+            'pk').values('pk')[1:1 + deleted]).delete()
+        cache.clear()
+        response = self.authorized_client.get(
+            url, {'page': models.SECOND_PAGE})
+        page_obj = response.context['page_obj']
+        paginator = page_obj.paginator
+        self.assertEqual(page_obj.number, models.SECOND_PAGE)
+        self.assertEqual(paginator.count, total - deleted)
+        self.assertEqual(
+            len(page_obj), total - deleted - settings.POSTS_ON_MAIN)
+        self.assertFalse(page_obj.has_next())
+        self.assertEqual(page_obj.paginator.num_pages, models.SECOND_PAGE)
+        # Страница за концом ленты — 404, а не последняя по оценке
+        response = self.authorized_client.get(url, {'page': 3})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(COUNT_ESTIMATE_THRESHOLD=3)
+    def test_page_past_estimate(self):
+        """ Страница дальше заниженной оценки отдаётся по своему номеру """
+        newest = Post.objects.order_by('-pk').values('pk')
+        Post.objects.filter(pk__in=newest[1:3]).delete()
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'page': models.SECOND_PAGE})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.number, models.SECOND_PAGE)
+        self.assertEqual(len(page_obj), models.TEST_RANGE - 2)
+        self.assertEqual(list(page_obj), list(Post.objects.order_by(
+            '-pub_date', '-pk')[settings.POSTS_ON_MAIN:]))
+
+    def test_elided_page_range(self):
+        """ Окно страниц: края, текущая ± 3 и пропуски """
+        paginator = CountingPaginator(range(1000), 1)
+        for number, expected in (
+            (1, [1, 2, 3, 4, None, 1000]),
+            (500, [1, None, 497, 498, 499, 500, 501, 502, 503, None, 1000]),
+            (998, [1, None, 995, 996, 997, 998, 999, 1000]),
+        ):
+            with self.subTest(number=number):
+                self.assertEqual(
+                    list(paginator.get_elided_page_range(number)), expected)
+        self.assertEqual(list(CountingPaginator(
+            range(3), 1).get_elided_page_range(2)), [1, 2, 3])
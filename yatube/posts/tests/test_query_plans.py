@@ -0,0 +1,81 @@
+import re
+import shutil
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .fixtures import models
+from ..utils import CursorPaginator
+
+# Проход по таблице: "SCAN posts_post" или "SCAN TABLE posts_post"
+SCAN_RE = re.compile(r'SCAN (TABLE )?(?P<table>\w+)')
+# Ограниченный подзапрос COUNT(*) FROM (... LIMIT n) — не таблица
+SUBQUERY = 'subquery'
+# Сортировка во временном дереве: порядок ленты не совпал с индексом
+SORT = 'USE TEMP B-TREE FOR'
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN SQLite')
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = models.user()
+        cls.second_user = models.second_user()
+        cls.group = models.group()
+        cls.post = models.post()
+        cls.comment = models.comment()
+        models.follow()
+        models.second_post()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def full_scans(self, sql):
+        """ Таблицы, которые запрос читает целиком, и сортировки
+        без индекса """
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        tables = [SCAN_RE.search(line).group('table') for line in plan
+                  if SCAN_RE.search(line) and 'INDEX' not in line]
+        sorts = [line for line in plan if line.startswith(SORT)]
+        return [table for table in tables if table != SUBQUERY] + sorts
+
+    def test_views_use_indexes(self):
+        """ Запросы лент и страниц постов идут по индексам """
+        views = (
+            ('posts:index', None, {}),
+            ('posts:index', None,
+             {'after': CursorPaginator.encode_cursor(self.post)}),
+            ('posts:index', None, {'page': 1}),
+            ('posts:group_list', (self.group.slug,), {}),
+            ('posts:profile', (self.second_user.username,), {}),
+            ('posts:post_detail', (self.post.id,), {}),
+            ('posts:post_detail', (self.post.id,),
+             {'after': CursorPaginator.encode_cursor(self.comment)}),
+            ('posts:follow_index', None, {}),
+            ('posts:follow_index', None,
+             {'after': CursorPaginator.encode_cursor(self.post)}),
+            ('posts:follow_index', None, {'page': 1}),
+        )
+        for name, args, params in views:
+            with self.subTest(name=name, params=params):
+                with CaptureQueriesContext(connection) as queries:
+                    self.authorized_client.get(reverse(name, args=args),
+                                               params)
+                for query in queries:
+                    if not query['sql'].startswith('SELECT'):
+                        continue
+                    with self.subTest(sql=query['sql']):
+                        self.assertEqual(self.full_scans(query['sql']), [])
@@ -1,11 +1,14 @@
+import shutil
 from http import HTTPStatus
 
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 
 from .fixtures import models
 
 
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
 class TaskURLTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -16,7 +19,13 @@ class TaskURLTests(TestCase):
         cls.group = models.group()
         cls.post = models.post()
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.second_authorized_client = Client()
         self.third_authorized_client = Client()
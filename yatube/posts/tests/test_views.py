@@ -1,14 +1,20 @@
+import shutil
+from unittest import mock
+
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.db import DatabaseError
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 
 
 from .fixtures import models
 from ..forms import PostForm
-from ..models import Follow, Post
+from .. import feed_cache, likes
+from ..models import Comment, Follow, Like, Post, Timeline, User
 
 
+@override_settings(MEDIA_ROOT=models.TEMP_MEDIA_ROOT)
 class TaskPagesTests(TestCase):
 
     @classmethod
@@ -21,7 +27,13 @@ class TaskPagesTests(TestCase):
         cls.comment = models.comment()
         cls.second_user = models.second_user()
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(models.TEMP_MEDIA_ROOT, ignore_errors=True)
+
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_second_client = Client()
         self.authorized_client.force_login(self.user)
@@ -54,6 +66,7 @@ class TaskPagesTests(TestCase):
         # Картинка есть в контексте Views
         self.assertEqual(
             post.image, self.post.image)
+        return response
 
     def test_index_show_correct_context(self):
         """ Проверка Index"""
@@ -61,18 +74,17 @@ class TaskPagesTests(TestCase):
 
     def test_group_list_show_correct_context(self):
         """ Проверка Group List"""
-        self.what_is_in_context('posts:group_list', (self.group.slug,))
+        # Повторный запрос пришёл бы из кэша страниц, без контекста
+        response = self.what_is_in_context(
+            'posts:group_list', (self.group.slug,))
         # Проверка доп.контекста 'group'
-        response = self.authorized_client.get(
-            reverse('posts:group_list', args=(self.group.slug,)))
         self.assertEqual(self.group, response.context['group'])
 
     def test_profile_show_correct_context(self):
         """ Проверка Profile"""
-        self.what_is_in_context('posts:profile', (self.user.username,))
+        response = self.what_is_in_context(
+            'posts:profile', (self.user.username,))
         # Проверка доп.контекста 'usermodel', 'post_list'
-        response = self.authorized_client.get(
-            reverse('posts:profile', args=(self.user.username,)))
         self.assertEqual(self.user, response.context['usermodel'])
         # Проверка количества постов пользователя
         post_list = response.context['post_list']
@@ -129,7 +141,8 @@ class TaskPagesTests(TestCase):
             reverse('posts:index')
         )
         first_context = first_response.content
-        Post.objects.all().delete()
+        # update() не шлёт сигналов — версия ленты не меняется
+        Post.objects.update(text='ChangedWithoutSignals')
         second_response = self.authorized_client.get(
             reverse('posts:index')
         )
@@ -142,6 +155,30 @@ class TaskPagesTests(TestCase):
         third_context = third_response.content
         self.assertNotEqual(third_context, second_context)
 
+    def test_cache_invalidated_by_post_changes(self):
+        """ Новый и удалённый пост сбрасывают кэш ленты """
+        first_context = self.authorized_client.get(
+            reverse('posts:index')).content
+        new_post = models.second_post()
+        second_context = self.authorized_client.get(
+            reverse('posts:index')).content
+        self.assertNotEqual(first_context, second_context)
+        new_post.delete()
+        third_context = self.authorized_client.get(
+            reverse('posts:index')).content
+        self.assertEqual(first_context, third_context)
+
+    def test_follow_cache_is_per_user(self):
+        """ Кэш ленты подписок у каждого пользователя свой """
+        models.follow()
+        models.second_post()
+        first_context = self.authorized_client.get(
+            reverse('posts:follow_index')).content.decode()
+        second_context = self.authorized_second_client.get(
+            reverse('posts:follow_index')).content.decode()
+        self.assertIn('Автор: SecondTestUser', first_context)
+        self.assertNotIn('Автор: SecondTestUser', second_context)
+
     def test_user_can_follow(self):
         """ Проверка пользователь может подписаться """
         count = Follow.objects.all().count()
@@ -227,3 +264,284 @@ class TaskPagesTests(TestCase):
         self.assertNotIn(
             post_by_author, response.context['page_obj'].object_list
         )
+
+    def test_timeline_fan_out(self):
+        """ Пост попадает в материализованную ленту и уходит при отписке """
+        models.follow()
+        post_by_author = models.second_post()
+        self.assertTrue(Timeline.objects.filter(
+            user=self.user, post=post_by_author).exists())
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    args=(self.second_user.username,)))
+        self.assertFalse(Timeline.objects.filter(user=self.user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_timeline_pull_on_read(self):
+        """ Посты авторов с большим числом подписчиков читаются напрямую """
+        cache.clear()
+        models.follow()
+        post_by_author = models.second_post()
+        self.assertFalse(Timeline.objects.exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertIn(
+            post_by_author, response.context['page_obj'].object_list
+        )
+
+    def test_timeline_merges_pulled_posts(self):
+        """ Лента сливает Timeline и pull-on-read без дублей """
+        models.follow()
+        old_post = models.second_post()
+        with override_settings(TIMELINE_FANOUT_LIMIT=0):
+            cache.clear()
+            new_post = models.second_post()
+            for params in ({}, {'page': 1}):
+                with self.subTest(params=params):
+                    response = self.authorized_client.get(
+                        reverse('posts:follow_index'), params)
+                    self.assertEqual(
+                        list(response.context['page_obj'].object_list),
+                        [new_post, old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_backfill_after_pull_on_read(self):
+        """ Автор, вернувшийся к рассылке, раскладывает посты по лентам """
+        cache.clear()
+        reader = User.objects.create_user(username='ThirdTestUser')
+        models.follow()
+        follow = Follow.objects.create(user=reader, author=self.second_user)
+        post_by_author = models.second_post()
+        self.assertFalse(Timeline.objects.filter(
+            post=post_by_author).exists())
+        follow.delete()
+        self.assertTrue(Timeline.objects.filter(
+            user=self.user, post=post_by_author).exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj'].object_list), [post_by_author])
+
+    def test_search(self):
+        """ Поиск находит посты по словам и префиксу """
+        models.second_post()
+        for query, expected in (('TestText', 2), ('testtexttest', 1),
+                                ('Nothing', 0), ('"', 0), ('', 0)):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    reverse('posts:search'), {'q': query})
+                self.assertEqual(
+                    len(response.context['page_obj'].object_list), expected)
+        response = self.client.get(reverse('posts:search'), {'q': 'TestText'})
+        self.assertEqual(
+            response.context['page_obj'][0].author, self.second_user)
+
+    @override_settings(COMMENTS_ON_PAGE=2)
+    def test_comment_pages(self):
+        """ Комментарии поста отдаются страницами по курсору """
+        Comment.objects.bulk_create(
+            Comment(text='Comment {}'.format(index), author=self.user,
+                    post=self.post) for index in range(4))
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,)))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 2)
+        self.assertTrue(comments.has_next())
+        fragment = reverse('posts:post_comments', args=(self.post.pk,))
+        self.assertContains(response, fragment)
+        seen = set(comments)
+        cursor = comments.next_cursor
+        while cursor:
+            response = self.client.get(fragment, {'after': cursor})
+            self.assertTemplateNotUsed(response, 'base.html')
+            comments = response.context['comments']
+            self.assertFalse(seen & set(comments))
+            seen.update(comments)
+            cursor = comments.next_cursor
+        self.assertEqual(seen, set(self.post.comments.all()))
+
+    @override_settings(LIKES_FLUSH_EVENTS=3, LIKES_FLUSH_INTERVAL=60000)
+    def test_likes(self):
+        """ Лайк идемпотентен, счётчик пишется в базу пачкой """
+        likes.buffer.pending.clear()
+        detail = reverse('posts:post_detail', args=(self.post.pk,))
+        like = reverse('posts:post_like', args=(self.post.pk,))
+        self.assertEqual(self.authorized_client.get(like).status_code, 405)
+        self.authorized_client.post(like)
+        self.authorized_client.post(like)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+        response = self.authorized_client.get(detail)
+        self.assertContains(response, '&#9829; 1')
+        self.assertContains(
+            response, reverse('posts:post_unlike', args=(self.post.pk,)))
+        # Пока событий меньше LIKES_FLUSH_EVENTS, база не обновлялась
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).like_count, 0)
+        self.authorized_second_client.post(like)
+        self.assertContains(self.client.get(detail), '&#9829; 2')
+        self.authorized_client.post(
+            reverse('posts:post_unlike', args=(self.post.pk,)))
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).like_count, 1)
+        self.assertContains(self.client.get(detail), '&#9829; 1')
+
+    @override_settings(LIKES_FLUSH_EVENTS=100, LIKES_FLUSH_INTERVAL=60000)
+    def test_likes_flush(self):
+        """ Буфер пишется по окончании запроса, ошибка базы не даёт 500 """
+        likes.buffer.pending.clear()
+        like = reverse('posts:post_like', args=(self.post.pk,))
+        with mock.patch.object(
+                likes.Post.objects, 'filter', side_effect=DatabaseError):
+            with override_settings(LIKES_FLUSH_INTERVAL=0), \
+                    self.assertLogs('posts.likes', 'ERROR'):
+                response = self.authorized_client.post(like)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(likes.buffer.delta(self.post.pk), 1)
+        self.client.get(reverse('posts:index'))
+        self.assertEqual(likes.buffer.delta(self.post.pk), 1)
+        with override_settings(LIKES_FLUSH_INTERVAL=0):
+            self.client.get(reverse('posts:index'))
+        self.assertEqual(likes.buffer.delta(self.post.pk), 0)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+    @override_settings(POST_EXCERPT_LENGTH=20)
+    def test_cards_show_excerpt(self):
+        """ Карточки показывают начало текста без загрузки полного """
+        post = Post.objects.create(
+            text='Long <b>text</b>\n' * 10, author=self.user,
+            group=self.group)
+        self.assertEqual(
+            post.excerpt_html, 'Long &lt;b&gt;text&lt;/b&gt;<br>Lo…')
+        self.assertTrue(post.excerpt_truncated)
+        response = self.client.get(reverse('posts:index'))
+        card = response.context['page_obj'][0]
+        self.assertEqual(card, post)
+        self.assertIn('text', card.get_deferred_fields())
+        self.assertContains(response, post.excerpt_html)
+        self.assertContains(response, 'Читать дальше')
+        self.assertNotContains(response, '<b>')
+
+    def test_stored_html(self):
+        """ Страница поста выводит HTML, собранный при сохранении """
+        post = Post.objects.create(
+            text='First <line>\nSecond', author=self.user)
+        comment = Comment.objects.create(
+            text='<Comment>\ntext', author=self.user, post=post)
+        self.assertEqual(post.text_html, 'First &lt;line&gt;<br>Second')
+        self.assertEqual(comment.text_html, '&lt;Comment&gt;<br>text')
+        Post.objects.filter(pk=post.pk).update(text_html='<i>Stored</i>')
+        response = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,)))
+        self.assertContains(response, '<i>Stored</i>')
+        self.assertContains(response, comment.text_html)
+
+    def test_page_cache_for_anonymous(self):
+        """ Аноним получает страницу из кэша до изменения её объектов """
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+                response = self.client.get(url)
+                self.assertEqual(response['X-Page-Cache'], 'hit')
+                self.assertIn('Cookie', response['Vary'])
+        # Авторизованным кэш не отдаётся
+        response = self.authorized_client.get(pages[0])
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'EditedText'
+        post.save()
+        for url in pages:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotEqual(response.get('X-Page-Cache'), 'hit')
+                self.assertContains(response, 'EditedText')
+
+    def test_page_cache_invalidated_by_comments_and_follows(self):
+        """ Комментарий сбрасывает страницу поста, подписка — профиль """
+        detail = reverse('posts:post_detail', args=(self.post.pk,))
+        profile = reverse('posts:profile', args=(self.second_user.username,))
+        self.client.get(detail)
+        self.client.get(profile)
+        version = feed_cache.get_version(feed_cache.POSTS_VERSION_KEY)
+        self.authorized_client.post(
+            reverse('posts:create_comment', args=(self.post.pk,)),
+            {'text': 'NewComment'})
+        self.assertContains(self.client.get(detail), 'NewComment')
+        # Кэш лент комментарий не сбрасывает
+        self.assertEqual(
+            feed_cache.get_version(feed_cache.POSTS_VERSION_KEY), version)
+        # Счётчик на карточке в ленте
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Комментариев: 2')
+        models.follow()
+        response = self.client.get(profile)
+        self.assertNotEqual(response.get('X-Page-Cache'), 'hit')
+        self.assertEqual(response.context['stats'].followers, 1)
+
+    def test_edge_fragments_for_authorized(self):
+        """ Общая часть страницы одна, фрагменты у каждого свои """
+        profile = reverse('posts:profile', args=(self.user.username,))
+        detail = reverse('posts:post_detail', args=(self.post.pk,))
+        response = self.authorized_second_client.get(profile)
+        self.assertContains(response, 'Подписаться')
+        self.assertNotContains(response, '<!--edge:')
+        response = self.authorized_client.get(profile)
+        self.assertEqual(response['X-Page-Cache'], 'edge')
+        self.assertNotContains(response, 'Подписаться')
+        self.assertContains(response, self.user.username)
+        self.authorized_client.get(detail)
+        response = self.authorized_second_client.get(detail)
+        self.assertEqual(response['X-Page-Cache'], 'edge')
+        self.assertNotContains(response, 'Редактировать пост')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(
+            self.authorized_client.get(detail), 'Редактировать пост')
+        second_profile = reverse(
+            'posts:profile', args=(self.second_user.username,))
+        self.authorized_second_client.get(second_profile)
+        models.follow()
+        self.assertContains(
+            self.authorized_client.get(second_profile), 'Отписаться')
+
+    def test_conditional_get(self):
+        """ Повторный запрос без изменений получает 304 Not Modified """
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        # Первый ответ с формой выдаёт cookie CSRF — токен входит в ETag
+        self.authorized_client.get(pages[-1])
+        self.authorized_second_client.get(pages[-1])
+        for url in pages:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertIn('private', response['Cache-Control'])
+                etag = response['ETag']
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                # Другому пользователю та же версия не подходит
+                response = self.authorized_second_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                response = self.client.get(url)
+                self.assertIn('public', response['Cache-Control'])
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'],
+                        HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(response.status_code, 304)
+        etags = [self.authorized_client.get(url)['ETag'] for url in pages]
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'EditedText'
+        post.save()
+        for url, etag in zip(pages, etags):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db.models import F
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from .feed_cache import bump_posts_version, invalidate_post_pages
+from .models import ThumbnailJob
+
+
+class PresetThumbnailBackend(ThumbnailBackend):
+    """ Backend sorl, умеющий искать готовую миниатюру без генерации """
+
+    def get_ready_thumbnail(self, file_, geometry_string, **options):
+        """ Миниатюра из KV-хранилища sorl или None """
+        if not file_:
+            return None
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(thumbnail_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def ready_thumbnail(image, preset):
+    """ Готовая миниатюра пресета из THUMBNAIL_PRESETS или None """
+    geometry, options = settings.THUMBNAIL_PRESETS[preset]
+    return default.backend.get_ready_thumbnail(image, geometry, **options)
+
+
+def enqueue(post):
+    """ Поставить генерацию миниатюр поста в очередь """
+    if not post.image:
+        return
+    ThumbnailJob.objects.bulk_create(
+        ThumbnailJob(post=post, preset=preset)
+        for preset in settings.THUMBNAIL_PRESETS
+    )
+
+
+def process_jobs(batch_size=50):
+    """ Обработать пачку заданий очереди; возвращает число обработанных """
+    jobs = list(ThumbnailJob.objects.filter(
+        attempts__lt=settings.THUMBNAIL_JOB_MAX_ATTEMPTS
+    ).select_related('post')[:batch_size])
+    for job in jobs:
+        geometry, options = settings.THUMBNAIL_PRESETS.get(
+            job.preset, (None, None))
+        try:
+            if geometry and job.post.image:
+                get_thumbnail(job.post.image, geometry, **options)
+        except Exception as error:
+            ThumbnailJob.objects.filter(pk=job.pk).update(
+                attempts=F('attempts') + 1, last_error=str(error))
+        else:
+            job.delete()
+            # Вместо заглушки в закэшированных страницах нужна картинка
+            invalidate_post_pages(job.post)
+            bump_posts_version()
+    return len(jobs)
+
+
+def make_thumbnails(image):
+    """ Сгенерировать недостающие миниатюры всех пресетов картинки.
+
+    Возвращает число созданных миниатюр.
+    """
+    created = 0
+    for preset, (geometry, options) in settings.THUMBNAIL_PRESETS.items():
+        if ready_thumbnail(image, preset) is None:
+            get_thumbnail(image, geometry, **options)
+            created += 1
+    return created
@@ -0,0 +1,236 @@
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from core.stampede import get_or_compute
+
+from . import counts
+from .models import AuthorStats, Follow, Post, Timeline
+from .utils import keyset
+
+CELEBRITIES_KEY = 'posts:timeline:celebrities'
+
+
+def celebrity_ids():
+    """ Авторы, чьи посты читаются из ленты напрямую (pull-on-read) """
+    def collect():
+        return set(AuthorStats.objects.filter(
+            followers__gt=settings.TIMELINE_FANOUT_LIMIT
+        ).values_list('author', flat=True))
+    return get_or_compute(
+        CELEBRITIES_KEY, collect, settings.TIMELINE_CELEBRITIES_TIMEOUT)
+
+
+def fan_out(posts):
+    """ Разложить новые посты по лентам подписчиков авторов.
+
+    Возвращает подписчиков, получивших посты, по авторам.
+    """
+    celebrities = celebrity_ids()
+    by_author = {}
+    for post in posts:
+        if post.author_id not in celebrities:
+            by_author.setdefault(post.author_id, []).append(post)
+    entries = []
+    followers_by_author = {}
+    for author_id, author_posts in by_author.items():
+        followers = followers_by_author[author_id] = list(
+            Follow.objects.filter(
+                author_id=author_id).values_list('user_id', flat=True))
+        entries.extend(
+            Timeline(user_id=user_id, post=post, author_id=author_id,
+                     pub_date=post.pub_date)
+            for user_id in followers for post in author_posts
+        )
+    Timeline.objects.bulk_create(
+        entries, batch_size=500, ignore_conflicts=True)
+    return followers_by_author
+
+
+def backfill(author_id, user_ids):
+    """ Добавить в ленты последние посты автора без pull-on-read.
+
+    Возвращает число постов, добавленных в каждую ленту.
+    """
+    posts = list(Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date')[:settings.TIMELINE_BACKFILL])
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=pk, author_id=author_id,
+                  pub_date=pub_date)
+         for user_id in user_ids for pk, pub_date in posts),
+        batch_size=500, ignore_conflicts=True,
+    )
+    return len(posts)
+
+
+def followers_changed(author_id, delta, followers=None):
+    """ Подписчиков стало больше или меньше TIMELINE_FANOUT_LIMIT.
+
+    Набор знаменитостей сбрасывается, чтобы рассылка и чтение ленты
+    сразу видели одно и то же. Автор, вернувшийся к рассылке, заново
+    раскладывает свои посты по лентам подписчиков: пока он читался
+    напрямую, новые посты в Timeline не попадали. followers — число
+    подписчиков после изменения, если оно уже известно. Счётчики лент
+    подписчиков при этом пересчитываются. Возвращает пару: читался ли
+    автор напрямую до изменения и читается ли теперь.
+    """
+    if followers is None:
+        followers = AuthorStats.objects.filter(
+            author_id=author_id).values_list('followers', flat=True).first()
+    if followers is None:
+        # Строки нет, только когда автор удаляется вместе с подписками
+        followers = Follow.objects.filter(author_id=author_id).count()
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    pulled = followers > limit
+    was_pulled = followers - delta > limit
+    if pulled != was_pulled:
+        cache.delete(CELEBRITIES_KEY)
+        user_ids = list(Follow.objects.filter(
+            author_id=author_id).values_list('user_id', flat=True))
+        if not pulled:
+            backfill(author_id, user_ids)
+        counts.drop_follow_counts(user_ids)
+    return was_pulled, pulled
+
+
+def prune(user_id, author_id):
+    """ Убрать посты автора из ленты при отписке; возвращает их число """
+    deleted, _ = Timeline.objects.filter(
+        user_id=user_id, author_id=author_id).delete()
+    return deleted
+
+
+def feed_user_ids(post):
+    """ Ленты, в которых пост учтён счётчиком записей Timeline """
+    if post.author_id in celebrity_ids():
+        # Записи знаменитостей лента пропускает
+        return []
+    return list(Timeline.objects.filter(
+        post_id=post.pk).values_list('user_id', flat=True))
+
+
+class FollowFeed:
+    """ Лента подписок: записи Timeline плюс посты pull-on-read авторов.
+
+    Каждый источник читается ограниченным keyset-запросом по своему
+    индексу: Timeline — по (user, -pub_date, -post) с постами страницы
+    через JOIN по id, посты знаменитостей — по (author, -pub_date, -id).
+    Результаты сливаются по (pub_date, id).
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.posts = Post.objects.select_related(
+            'author', 'group').for_cards()
+
+    @cached_property
+    def pulled(self):
+        """ Подписки пользователя на авторов с pull-on-read """
+        celebrities = celebrity_ids()
+        if not celebrities:
+            return []
+        return list(Follow.objects.filter(
+            user=self.user, author_id__in=celebrities
+        ).values_list('author_id', flat=True))
+
+    @property
+    def entries(self):
+        entries = Timeline.objects.filter(user=self.user)
+        if self.pulled:
+            # Записи, оставшиеся с тех пор, как автор не был знаменитостью
+            entries = entries.exclude(author_id__in=self.pulled)
+        return entries
+
+    def _authors(self):
+        return (Post.objects.filter(author_id=author_id)
+                for author_id in self.pulled)
+
+    def keyset(self, limit, after=None, before=None):
+        """ Посты для CursorPaginator """
+        entries = keyset(self.entries.for_cards(), limit, after, before,
+                         fields=('pub_date', 'post_id'))
+        sources = [(entry.post for entry in entries)]
+        sources.extend(
+            keyset(posts.select_related('author', 'group').for_cards(),
+                   limit, after, before)
+            for posts in self._authors())
+        return list(islice(heapq.merge(
+            *sources, key=attrgetter('pub_date', 'pk'),
+            reverse=before is None,
+        ), limit))
+
+    def __getitem__(self, index):
+        """ Срез для нумерованных страниц, читается при обращении """
+        if not isinstance(index, slice) or index.step:
+            raise TypeError('FollowFeed supports only plain slices.')
+        start, stop = index.start or 0, index.stop
+        return SimpleLazyObject(lambda: self._slice(start, stop))
+
+    def _slice(self, start, stop):
+        if not self.pulled:
+            entries = keyset(self.entries.for_cards(), stop,
+                             fields=('pub_date', 'post_id'))
+            return [entry.post for entry in entries[start:]]
+        # Из каждого источника нужны первые stop ключей; посты
+        # загружаются только для самой страницы
+        sources = [keyset(self.entries.values_list('pub_date', 'post_id'),
+                          stop, fields=('pub_date', 'post_id'))]
+        sources.extend(keyset(posts.values_list('pub_date', 'pk'), stop)
+                       for posts in self._authors())
+        keys = list(islice(heapq.merge(*sources, reverse=True), start, stop))
+        posts = self.posts.in_bulk([pk for pub_date, pk in keys])
+        return [posts[pk] for pub_date, pk in keys if pk in posts]
+
+    def count_sources(self):
+        """ Счётчики для CountingPaginator: записи Timeline пользователя
+        и посты каждого pull-on-read автора, как на его странице """
+        sources = [(counts.follow_count_key(self.user.pk), self.entries)]
+        sources.extend(
+            (counts.count_key(Post, author_id=author_id), posts)
+            for author_id, posts in zip(self.pulled, self._authors()))
+        return sources
+
+    def count(self):
+        """ Число постов ленты """
+        return sum(source.count()
+                   for source in (self.entries, *self._authors()))
+
+    def __len__(self):
+        return self.count()
+
+
+def follow_feed(user):
+    """ Лента подписок пользователя """
+    return FollowFeed(user)
+
+
+@transaction.atomic
+def rebuild():
+    """ Пересобрать все ленты одним INSERT ... SELECT.
+
+    Для массовых загрузок, обошедших сигналы; авторы с pull-on-read
+    пропускаются. Возвращает число записей в лентах.
+    """
+    cache.delete(CELEBRITIES_KEY)
+    Timeline.objects.all().delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {timeline} (user_id, post_id, author_id, pub_date) '
+            'SELECT follow.user_id, post.id, post.author_id, post.pub_date '
+            'FROM {follow} follow '
+            'INNER JOIN {post} post ON post.author_id = follow.author_id '
+            'WHERE follow.user_id IS NOT NULL AND follow.author_id NOT IN '
+            '(SELECT author_id FROM {stats} WHERE followers > %s)'.format(
+                timeline=Timeline._meta.db_table,
+                follow=Follow._meta.db_table,
+                post=Post._meta.db_table,
+                stats=AuthorStats._meta.db_table,
+            ),
+            [settings.TIMELINE_FANOUT_LIMIT],
+        )
+    return Timeline.objects.count()
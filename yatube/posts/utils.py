@@ -1,11 +1,262 @@
+import base64
+import binascii
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from . import counts
+
+
+class CursorPaginator(Paginator):
+    """ Paginator по курсору (pub_date, id) без COUNT и OFFSET.
+
+    Отдаёт обычный Page: number и num_pages подбираются так, чтобы
+    has_next/has_previous шаблона paginator.html работали как раньше.
+    """
+    cursor = True
+
+    def __init__(self, object_list, per_page):
+        super().__init__(object_list, per_page)
+        self.after = self.before = None
+
+    @property
+    def count(self):
+        """ Количество объектов неизвестно — COUNT не выполняется """
+        return None
+
+    @property
+    def num_pages(self):
+        return self._state['num_pages']
+
+    @staticmethod
+    def encode_cursor(obj):
+        """ Непрозрачный токен из (pub_date, id) объекта """
+        raw = '{}|{}'.format(obj.pub_date.isoformat(), obj.pk)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(token):
+        """ Разбор токена; None, если токен битый """
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(
+                token + '=' * (-len(token) % 4)).decode()
+            pub_date, pk = raw.rsplit('|', 1)
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        if pub_date is None:
+            return None
+        return pub_date, pk
+
+    def get_cursor_page(self, after=None, before=None):
+        """ Страница после/до курсора.
+
+        Строки читаются при первом обращении к странице: если шаблон
+        отдал ленту из {% swrcache %}, запроса к базе нет.
+        """
+        self.after = self.decode_cursor(after)
+        self.before = None if self.after else self.decode_cursor(before)
+        page = Page(self._lazy('rows'), self._lazy('number'), self)
+        page.next_cursor = self._lazy('next_cursor')
+        page.previous_cursor = self._lazy('previous_cursor')
+        return page
+
+    def _lazy(self, name):
+        return SimpleLazyObject(lambda: self._state[name])
+
+    @cached_property
+    def _state(self):
+        """ per_page + 1 строк после/до курсора и навигация по ним """
+        # Источник со своим keyset (лента подписок) или queryset постов
+        fetch = getattr(self.object_list, 'keyset', None)
+        if fetch is None:
+            def fetch(limit, after=None, before=None):
+                return keyset(self.object_list, limit, after, before)
+        rows = list(fetch(
+            self.per_page + 1, after=self.after, before=self.before))
+        if self.before:
+            has_previous = len(rows) > self.per_page
+            has_next = True
+            rows = rows[:self.per_page][::-1]
+        else:
+            has_previous = self.after is not None
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        number = 2 if has_previous else 1
+        return {
+            'rows': rows,
+            'number': number,
+            'num_pages': number + 1 if has_next else number,
+            'next_cursor': (
+                self.encode_cursor(rows[-1]) if has_next and rows else None),
+            'previous_cursor': (
+                self.encode_cursor(rows[0]) if has_previous and rows
+                else None),
+        }
+
+
+def keyset(queryset, limit, after=None, before=None,
+           fields=('pub_date', 'pk'), where=None):
+    """ До limit строк старше курсора after или новее before.
 
+    Курсоры — пары (pub_date, id) для полей fields. Без before строки
+    идут от новых к старым, с before — от старых к новым. where
+    добавляется в тот же filter(), что и условие курсора: так условия
+    по многозначной связи относятся к одному JOIN.
+    """
+    date_field, id_field = fields
+    condition = where or Q()
+    if before or after:
+        pub_date, pk = before or after
+        op = '__gt' if before else '__lt'
+        condition &= (
+            Q(**{date_field + op: pub_date})
+            | Q(**{date_field: pub_date, id_field + op: pk}))
+    queryset = queryset.filter(condition)
+    if before:
+        queryset = queryset.order_by(date_field, id_field)
+    else:
+        queryset = queryset.order_by('-' + date_field, '-' + id_field)
+    return queryset[:limit]
 
-def paginator(request, post_list):
-    """ Paginator для приложения Posts"""
-    paginator_get = Paginator(post_list, settings.POSTS_ON_MAIN)
+
+class CountingPaginator(Paginator):
+    """ Paginator, берущий количество объектов из кэша.
+
+    count_key — ключ счётчика из posts.counts; ленты из нескольких
+    источников (FollowFeed) отдают счётчики сами через count_sources().
+    Счётчики обновляются сигналами, так что COUNT выполняется только
+    при промахе кэша.
+    Выше COUNT_ESTIMATE_THRESHOLD количество — оценка: номер страницы
+    не ограничен ею, а конец ленты виден по строкам самой страницы.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None):
+        super().__init__(object_list, per_page)
+        self.count_key = count_key
+
+    @cached_property
+    def count_sources(self):
+        """ Пары (ключ счётчика, queryset); пусто — COUNT без кэша """
+        sources = getattr(self.object_list, 'count_sources', None)
+        if sources is not None:
+            return sources()
+        if self.count_key is None:
+            return []
+        return [(self.count_key, self.object_list)]
+
+    @cached_property
+    def count(self):
+        if not self.count_sources:
+            return super().count
+        return sum(counts.get_count(key, queryset)
+                   for key, queryset in self.count_sources)
+
+    @property
+    def estimated(self):
+        """ Количество оценено, а не посчитано """
+        return bool(self.count_sources) and counts.is_estimate(self.count)
+
+    def validate_number(self, number):
+        if not self.estimated:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы — не целое число')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        """ Страница; при оценке строки читаются с запасом в одну.
+
+        Лишняя строка показывает, есть ли следующая страница, а её
+        отсутствие — что эта страница последняя и количество точное.
+        """
+        if not self.estimated:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('Страница за концом ленты')
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            self.num_pages = max(self.num_pages, number + 1)
+        else:
+            self.count = bottom + len(rows)
+            self.num_pages = number
+        return self._get_page(rows, number, self)
+
+    def get_page(self, number):
+        """ Как Paginator.get_page, но номер за концом оценённой ленты —
+        404: последняя страница по оценке может быть не той """
+        if not self.estimated:
+            return super().get_page(number)
+        try:
+            return self.page(number)
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            raise Http404('Нет страницы {}'.format(number))
+
+    def get_elided_page_range(self, number=1, on_each_side=3, on_ends=1):
+        """ Номера страниц: края и окно вокруг текущей, пропуски — None.
+
+        Генератор из трёх коротких отрезков: page_range целиком
+        не создаётся, сколько бы ни было страниц. При оценке конца
+        ленты в окне нет: он обозначается пропуском.
+        """
+        num_pages = self.num_pages
+        number = self.validate_number(number)
+        segments = [
+            (1, min(on_ends, num_pages)),
+            (max(number - on_each_side, 1),
+             min(number + on_each_side, num_pages)),
+        ]
+        if not self.estimated:
+            segments.append((max(num_pages - on_ends + 1, 1), num_pages))
+        last = 0
+        for start, end in segments:
+            if start > last + 1:
+                yield None
+            for page in range(max(start, last + 1), end + 1):
+                yield page
+            last = max(last, end)
+        if last < num_pages:
+            yield None
+
+
+def paginator(request, post_list, count_key=None):
+    """ Paginator для приложения Posts.
+
+    По умолчанию — курсорный (?after=/?before=), ?page=N оставлен
+    для нумерованных ссылок.
+    """
     page_number = request.GET.get('page')
-    page_obj = paginator_get.get_page(page_number)
+    if page_number is not None:
+        paginator_get = CountingPaginator(
+            post_list, settings.POSTS_ON_MAIN, count_key)
+        return paginator_get.get_page(page_number)
+    paginator_get = CursorPaginator(post_list, settings.POSTS_ON_MAIN)
+    return paginator_get.get_cursor_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
 
-    return page_obj
+def comments_page(request, post):
+    """ Страница комментариев поста по курсору ?after= """
+    comments = CursorPaginator(
+        post.comments.select_related('author'), settings.COMMENTS_ON_PAGE)
+    return comments.get_cursor_page(after=request.GET.get('after'))
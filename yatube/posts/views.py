@@ -1,26 +1,42 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render, redirect
+from django.views.decorators.http import require_POST
+
+from core.page_cache import conditional_page
 
+from . import likes, search, thumbnails
+from .counts import count_key
 from .models import Follow, Group, Post, User
+from .feed_cache import (
+    AUTHOR_TAG, GROUP_TAG, POST_TAG, POSTS_TAG, feed_context)
 from .forms import CommentForm, PostForm
-from .utils import paginator
+from .stats import get_stats
+from .timeline import follow_feed
+from .utils import CountingPaginator, comments_page, paginator
 
 
+@conditional_page(lambda request: (POSTS_TAG,))
 def index(request):
     """ Главная страница """
-    post_list = Post.objects.select_related('author', 'group').all()
-    page_obj = paginator(request, post_list)
+    post_list = Post.objects.select_related('author', 'group').for_cards()
+    page_obj = paginator(request, post_list, count_key(Post))
     context = {
         'page_obj': page_obj,
+        **feed_context(),
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(lambda request, slug: (GROUP_TAG.format(slug),))
 def group_posts(request, slug):
     """ Страница группы """
     group_with_slug = get_object_or_404(Group, slug=slug)
-    post_list = group_with_slug.posts.select_related('author').all()
-    page_obj = paginator(request, post_list)
+    post_list = group_with_slug.posts.select_related('author').for_cards()
+    page_obj = paginator(request, post_list, count_key(
+        Post, group_id=group_with_slug.pk))
     context = {
         'page_obj': page_obj,
         'group': group_with_slug,
@@ -28,37 +44,49 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(lambda request, username: (AUTHOR_TAG.format(username),))
 def profile(request, username):
     """ Страница автора поста """
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.select_related('group').all()
-    page_obj = paginator(request, post_list)
-    following = request.user.is_authenticated and author.following.filter(
-        user=request.user).exists()
+    post_list = author.posts.select_related('group').for_cards()
+    page_obj = paginator(request, post_list, count_key(
+        Post, author_id=author.pk))
     context = {
         'page_obj': page_obj,
         'usermodel': author,
         'post_list': post_list,
-        'following': following
+        'stats': get_stats(author),
     }
 
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(lambda request, post_id: (POST_TAG.format(post_id),),
+                  max_age=60)
 def post_detail(request, post_id):
     """ Подробное чтение поста """
     get_post = get_object_or_404(
-        Post.objects.select_related('author').prefetch_related(
-            'comments__author'), id=post_id)
+        Post.objects.select_related('author'), id=post_id)
     comment_form = CommentForm()
     context = {
         'onepost': get_post,
-        'comments': get_post.comments.all(),
+        'comments': comments_page(request, get_post),
         'comment_form': comment_form
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@conditional_page(lambda request, post_id: (POST_TAG.format(post_id),))
+def post_comments(request, post_id):
+    """ Следующая страница комментариев поста, HTML-фрагмент """
+    get_post = get_object_or_404(Post, id=post_id)
+    context = {
+        'onepost': get_post,
+        'comments': comments_page(request, get_post),
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     """ Функция создания поста """
@@ -67,6 +95,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.enqueue(post)
         return redirect('posts:profile', username=request.user.username)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -84,6 +113,8 @@ def post_edit(request, post_id):
     )
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.enqueue(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -96,7 +127,9 @@ def post_edit(request, post_id):
 @login_required
 def create_comment(request, post_id):
     """ Добавление комментария """
-    post = get_object_or_404(Post, id=post_id)
+    # Автор и группа нужны сигналу для сброса кэша страниц с постом
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -106,21 +139,51 @@ def create_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@require_POST
+@login_required
+def post_like(request, post_id):
+    """ Лайк посту """
+    get_object_or_404(Post.objects.only('pk'), id=post_id)
+    likes.like(request.user, post_id)
+    return redirect('posts:post_detail', post_id=post_id)
+
+
+@require_POST
+@login_required
+def post_unlike(request, post_id):
+    """ Отмена лайка """
+    likes.unlike(request.user, post_id)
+    return redirect('posts:post_detail', post_id=post_id)
+
+
 @login_required
 def follow_index(request):
     """ Все подписки пользователя """
-    post_list = Post.objects.select_related(
-        'author', 'group'
-    ).filter(
-        author__following__user=request.user
-    )
+    post_list = follow_feed(request.user)
+    # Количество постов лента берёт из своих счётчиков (count_sources)
     page_obj = paginator(request, post_list)
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        **feed_context(request.user),
     }
     return render(request, 'posts/follow.html', context)
 
 
+def search_posts(request):
+    """ Поиск по текстам постов """
+    query = request.GET.get('q', '').strip()
+    post_list = search.search(query).select_related(
+        'author', 'group').for_cards()
+    page_obj = CountingPaginator(post_list, settings.POSTS_ON_MAIN).get_page(
+        request.GET.get('page'))
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def profile_follow(request, username):
     """ View подписки на автора """
@@ -136,7 +199,11 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     """ View отписки на автора """
-    get_object_or_404(Follow,
-                      author__username=username,
-                      ).delete()
+    # Автор и подписчик нужны сигналу для сброса кэша их профилей,
+    # счётчики автора — для проверки лимита рассылки
+    get_object_or_404(
+        Follow.objects.select_related('author__stats', 'user'),
+        user=request.user,
+        author__username=username,
+    ).delete()
     return redirect('posts:profile', username=username)
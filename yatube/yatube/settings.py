@@ -28,11 +28,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.page_cache.PageCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.edge.EdgeIncludeMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -96,6 +100,10 @@ STATIC_URL = '/static/'
 
 # Amount of posts shown at the page
 POSTS_ON_MAIN = 10
+# Length of the post excerpt shown on feed cards
+POST_EXCERPT_LENGTH = 500
+# Amount of comments per page on the post page
+COMMENTS_ON_PAGE = 20
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -111,9 +119,106 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 # View для 403 ошибки
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
-# Кеширование страниц
+# Кеширование страниц: общий для всех воркеров SQLite-файл и перед ним
+# небольшой LRU в памяти процесса с коротким временем жизни. Счётчики
+# версий лент и набор авторов с pull-on-read всегда читаются из общего кэша
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_TIMEOUT': 5,
+            'LOCAL_MAX_ENTRIES': 500,
+            'LOCAL_BYPASS': ('posts:version:', 'page:tag:',
+                             'posts:timeline:'),
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            # Предел суммарного размера значений, в байтах
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
     }
 }
+
+# manage.py test подменяет общий уровень кэша памятью процесса, pytest —
+# фикстурой из tests/conftest.py (core.testing.memory_caches)
+TEST_RUNNER = 'core.testing.TestRunner'
+
+# Лента подписок: посты авторов, у которых подписчиков больше лимита,
+# не рассылаются по лентам, а читаются напрямую (pull-on-read)
+TIMELINE_FANOUT_LIMIT = 1000
+# Сколько последних постов автора добавить в ленту при подписке
+TIMELINE_BACKFILL = 1000
+# Время жизни кэша списка авторов с pull-on-read, в секундах
+TIMELINE_CELEBRITIES_TIMEOUT = 60
+
+# Время жизни закэшированных фрагментов лент, в секундах;
+# актуальность обеспечивает версия ленты в ключе
+FEED_CACHE_TIMEOUT = 5 * 60
+
+# Время жизни страниц в кэше для анонимов (core.page_cache) и общих частей
+# страниц для авторизованных (core.edge), в секундах; 0 отключает оба
+# кэша. Раньше страница устаревает по тегам из сигналов
+PAGE_CACHE_TIMEOUT = 60
+
+# Количество постов для нумерованных страниц (posts.counts): счётчики
+# в кэше обновляются сигналами, TTL в секундах страхует от расхождений
+# после массовых загрузок. Выше порога строки не считаются: количество
+# оценивается по плотности первичных ключей
+COUNT_CACHE_TIMEOUT = 60 * 60
+COUNT_ESTIMATE_THRESHOLD = 10000
+
+# Защита от лавины пересчётов ({% swrcache %}, core.stampede):
+# сколько секунд после истечения ещё отдавать устаревшее значение, пока
+# его пересчитывает один воркер; предельное время пересчёта; чем больше
+# BETA, тем раньше значение обновляется до истечения срока
+STAMPEDE_STALE_TIMEOUT = 60
+STAMPEDE_LOCK_TIMEOUT = 10
+STAMPEDE_BETA = 1.0
+
+# Миниатюры картинок постов, которые используют шаблоны:
+# генерируются заранее командой process_thumbnails
+THUMBNAIL_BACKEND = 'posts.thumbnails.PresetThumbnailBackend'
+THUMBNAIL_PRESETS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+THUMBNAIL_JOB_MAX_ATTEMPTS = 3
+
+# Профилирование запросов: заголовок Server-Timing, строка лога
+# core.profiling и гистограммы латентности по имени URL
+PROFILING_ENABLED = False
+# Метрики запросов по view (core.middleware.MetricsMiddleware) включены
+# по умолчанию и отдаются staff на /metrics. Общий для всех воркеров
+# файл метрик и как часто воркер дописывает в него накопленное, в секундах
+METRICS_ENABLED = True
+METRICS_DB = os.path.join(BASE_DIR, 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL = 5
+
+# Счётчики лайков (posts.likes): приращения копятся в памяти процесса
+# и пишутся в базу одной транзакцией раз в LIKES_FLUSH_INTERVAL
+# миллисекунд или каждые LIKES_FLUSH_EVENTS лайков. Показываемое
+# значение живёт в кэше LIKES_CACHE_TIMEOUT секунд
+LIKES_FLUSH_INTERVAL = 500
+LIKES_FLUSH_EVENTS = 100
+LIKES_CACHE_TIMEOUT = 5 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}